@@ -1,15 +1,26 @@
+import time
+
+import_start_time = time.perf_counter()
+
+from dataclasses import dataclass
+from typing import Callable
+
 import aqt
-import aqt.browser.previewer
-import aqt.deckbrowser
-import aqt.editor
-import aqt.theme
-import aqt.webview
 from aqt import gui_hooks
-from aqt.qt import Qt, QColor, QAction
-
-from .configuration import Config, run_on_configuration_change
+from aqt.qt import Qt, QColor, QAction, QWidget
+
+from . import configuration
+from .anki_environment import make_anki_environment, run_on_configuration_change
+from .configuration import Config, ConfigChanges, Wallpaper, WallpaperSwitcher, SCALING
+from .images import pixmap_cache, prefetch_pixmaps, cancel_prefetching_except
+from .painting import set_widget_wallpaper, unset_widget_wallpaper, get_widget_scales
+from .profiling import profiler, timed
+from .slideshow import Slideshow
 from .tools import append_to_method, replace_method, prepend_to_method
-from .tools import get_dialog_instance_or_none
+from .tools import set_style_sheet
+from .variants import get_largest_screen_size, get_wallpapers_with_downscaled_variants
+from .watching import FolderWatcher
+from .widgets import MAIN_WINDOW, DIALOG, PREVIEWER, wallpapered_widgets
 
 
 anki_version = tuple(int(segment) for segment in aqt.appVersion.split("."))
@@ -22,70 +33,104 @@ ALTERED_DIALOGS_CLASS_NAMES = {
 }
 
 
-ALTERED_DIALOGS_DIALOG_MANAGER_TAGS = {
-    "AddCards",
-    "EditCurrent",
-    "foosoft.ankiconnect.Edit",
-}
-
+# Setting a style sheet makes Qt re-polish all children of the widget,
+# which is slow for the main window, so style sheets are only set when they change.
+# They don't depend on the wallpaper, which is painted separately.
 
 # This also removes the weird border below the menu bar that is present on Anki 2.1.50.
 # It is not changed with the theme for some reason.
+MAIN_WINDOW_STYLE_SHEET = r"""
+    QMenuBar { 
+        background: transparent;
+        border: none; 
+    }
+    
+    #centralwidget {  background: transparent; }
+"""
+
+PREVIEWER_WEB_VIEW_STYLE_SHEET = r"""
+    #_web { background: transparent }
+"""
+
+ADD_CARDS_FIELDS_AREA_STYLE_SHEET = r"""
+   #fieldsArea { background: transparent }
+"""
+
+EDITOR_WIDGET_STYLE_SHEET = r"""
+    EditorWebView { background: transparent }
+"""
+
+
 def set_main_window_wallpaper():
-    aqt.mw.setStyleSheet(rf"""
-        QMainWindow {{
-            background-image: url("{config.current_wallpaper.url}"); 
-            background-position: {config.current_wallpaper.position};
-        }}
-        
-        QMenuBar {{ 
-            background: transparent;
-            border: none; 
-        }}
-        
-        #centralwidget {{  background: transparent; }}
-    """)
+    set_style_sheet(aqt.mw, MAIN_WINDOW_STYLE_SHEET)
+    set_widget_wallpaper(aqt.mw, config.current_wallpaper, config.scaling)
 
 def unset_main_window_wallpaper():
-    aqt.mw.setStyleSheet("")
+    set_style_sheet(aqt.mw, "")
+    unset_widget_wallpaper(aqt.mw)
 
 
 def set_dialog_wallpaper(dialog):
-    dialog.setStyleSheet(rf"""
-        {dialog.__class__.__name__} {{
-            background-image: url("{config.current_wallpaper.url}"); 
-            background-position: {config.current_wallpaper.position};
-        }}
-    """)
+    set_widget_wallpaper(dialog, config.current_wallpaper, config.scaling)
 
 def unset_dialog_wallpaper(dialog):
-    dialog.setStyleSheet("")
+    unset_widget_wallpaper(dialog)
 
 
 def set_previewer_wallpaper(previewer):
-    previewer.setStyleSheet(rf"""
-        QDialog {{
-            background-image: url("{config.current_wallpaper.url}"); 
-            background-position: {config.current_wallpaper.position};
-        }}
-    """)
-
-
-# todo also change wallpaper for the previewer?
-#   previewer is not registered with the dialog manager
-#   so we can't just grab the instance as easily as with the other dialogs
-def set_wallpapers_now():
-    if config.is_enabled.for_main_window:
-        set_main_window_wallpaper()
-    else:
-        unset_main_window_wallpaper()
+    set_widget_wallpaper(previewer, config.current_wallpaper, config.scaling)
+
+def unset_previewer_wallpaper(previewer):
+    unset_widget_wallpaper(previewer)
+
+
+# Updates the main window, as well as every open dialog and previewer
+# that the add-on has styled, see `wallpapered_widgets`; or only the given widgets
+def set_wallpapers_now(widgets: "list[tuple[QWidget, str]] | None" = None):
+    if widgets is None:
+        widgets = wallpapered_widgets.get_widgets()
+
+    for widget, kind in widgets:
+        if kind == MAIN_WINDOW:
+            if config.is_enabled.for_main_window:
+                set_main_window_wallpaper()
+            else:
+                unset_main_window_wallpaper()
 
-    for dialog_tag in ALTERED_DIALOGS_DIALOG_MANAGER_TAGS:
-        if dialog := get_dialog_instance_or_none(dialog_tag):
-            if config.is_enabled.for_dialog(class_name=dialog.__class__.__name__):
-                set_dialog_wallpaper(dialog)
+        elif kind == PREVIEWER:
+            if config.is_enabled.for_previewer:
+                set_previewer_wallpaper(widget)
             else:
-                unset_dialog_wallpaper(dialog)
+                unset_previewer_wallpaper(widget)
+
+        else:
+            if config.is_enabled.for_dialog(class_name=widget.__class__.__name__):
+                set_dialog_wallpaper(widget)
+            else:
+                unset_dialog_wallpaper(widget)
+
+    prefetch_neighbouring_wallpapers()
+
+
+# Decode the next and the previous wallpapers in the background, as well as
+# the variant of the current wallpaper for the other theme, if there is one,
+# scaled for the windows that currently show wallpapers,
+# so that switching to them merely takes pixmaps from the cache.
+def prefetch_neighbouring_wallpapers():
+    scales = get_widget_scales([widget for widget, _ in wallpapered_widgets.get_widgets()
+                                if widget.isVisible()])
+
+    for wallpaper in get_neighbouring_wallpapers():
+        prefetch_pixmaps(wallpaper.url, [*scales])
+
+
+def get_neighbouring_wallpapers() -> "list[Wallpaper]":
+    wallpapers = [config.get_wallpaper(1), config.get_wallpaper(-1)]
+
+    if paired_wallpaper := config.get_paired_wallpaper():
+        wallpapers.append(paired_wallpaper)
+
+    return wallpapers
 
 
 ############################################################################## web views
@@ -104,23 +149,35 @@ class MonstrousTransparentColor(QColor):
 monstrous_transparent_color = MonstrousTransparentColor()
 
 
-@prepend_to_method(aqt.editor.EditorWebView, "__init__")
+TRANSPARENT_WEB_VIEW_TITLES = frozenset({
+    "top toolbar",
+    "main webview",
+    "bottom toolbar",
+    "previewer",
+})
+
+
+# Editor web views of altered dialogs are transparent regardless of their title
 def editor_webview_init(self, _parent, editor):
     if editor.parentWindow.__class__.__name__ in ALTERED_DIALOGS_CLASS_NAMES:
         self._transparent = True
 
 
-@replace_method(aqt.webview.AnkiWebView, "get_window_bg_color")
+# Web views get their titles on creation, before the background color is requested,
+# so the decision can be made once and remembered
+def is_web_view_transparent(web_view) -> bool:
+    try:
+        return web_view._transparent
+    except AttributeError:
+        transparent = web_view._transparent = web_view.title in TRANSPARENT_WEB_VIEW_TITLES
+        return transparent
+
+
 def webview_get_window_bg_color(self, *args, **kwargs):
-    transparent = getattr(self, "_transparent", False) or self.title in [
-        "top toolbar",
-        "main webview",
-        "bottom toolbar",
-        "previewer"
-    ]
-
-    if transparent:
-        self.page().setBackgroundColor(Qt.GlobalColor.transparent)
+    if is_web_view_transparent(self):
+        page = self.page()
+        if page.backgroundColor().alpha() != 0:
+            page.setBackgroundColor(Qt.GlobalColor.transparent)
         return monstrous_transparent_color
     else:
         return webview_get_window_bg_color.original_method(self, *args, **kwargs)
@@ -129,38 +186,31 @@ def webview_get_window_bg_color(self, *args, **kwargs):
 ############################################################################## previewer
 
 
-@append_to_method(aqt.browser.previewer.Previewer, "__init__")
 def previewer_init(self, *_args, **_kwargs):
+    wallpapered_widgets.add(self, PREVIEWER)
+
     if config.is_enabled.for_previewer:
         set_previewer_wallpaper(self)
 
 
-@append_to_method(aqt.browser.previewer.Previewer, "show")
 def previewer_show(self, *_args, **_kwargs):
-    self._web.setStyleSheet(r"""
-        #_web { background: transparent }
-    """)
+    set_style_sheet(self._web, PREVIEWER_WEB_VIEW_STYLE_SHEET)
 
 
 ####################################################### add cards, edit current and edit
 
 
-@append_to_method(aqt.addcards.AddCards, "__init__")
 def add_cards_init(self, *_args, **_kwargs):
-    self.form.fieldsArea.setStyleSheet(r"""
-       #fieldsArea { background: transparent }
-    """)
+    set_style_sheet(self.form.fieldsArea, ADD_CARDS_FIELDS_AREA_STYLE_SHEET)
 
 
-@append_to_method(aqt.editor.Editor, "setupWeb")
 def editor_init(self, *_args, **_kwargs):
     dialog = self.parentWindow
     dialog_class_name = dialog.__class__.__name__
 
     if dialog_class_name in ALTERED_DIALOGS_CLASS_NAMES:
-        self.widget.setStyleSheet(r"""
-            EditorWebView { background: transparent }
-        """)
+        set_style_sheet(self.widget, EDITOR_WIDGET_STYLE_SHEET)
+        wallpapered_widgets.add(dialog, DIALOG)
 
         if config.is_enabled.for_dialog(dialog_class_name):
             set_dialog_wallpaper(dialog)
@@ -169,25 +219,55 @@ def editor_init(self, *_args, **_kwargs):
 ############################################################# web view css manipulations
 
 
-# * `current`: the class for the currently selected deck; solid color by default
-# * `zero-count`:  the class for zeros in the due cards table; barely visible by default
-# * `sticky-container`: the class for a div behind the button bars and the tag bar
-#    in the Editor. in night mode, these seem to have background color
-# * `container-fluid`: the same but in Anki 2.1.49.
-def webview_will_set_content(web_content: aqt.webview.WebContent, context):
-    if isinstance(context, aqt.deckbrowser.DeckBrowser):  # noqa
-        web_content.head += """<style>
-            .current { background-color: #fff3 !important }
-            .zero-count { color: #0005 !important }
-            .night-mode .zero-count { color: #fff5 !important }
-        </style>"""
+# The style sheets are in the `web` folder, and are served by Anki's media server,
+# so that the web engine can cache them instead of parsing them on every page.
+# They are the same for both themes, as Anki marks night mode with a class.
+# Contexts are matched by type; the result of matching is remembered for each type.
+WEB_EXPORTS_PATTERN = r"web/.*\.css"
+
+
+@dataclass
+class ContextStyleSheet:
+    context_class: type
+    file_name: str
+    applies_to: "Callable[[object], bool]" = lambda context: True
+
+
+def is_altered_editor(editor) -> bool:
+    return editor.parentWindow.__class__.__name__ in ALTERED_DIALOGS_CLASS_NAMES
+
+
+context_style_sheets: "list[ContextStyleSheet]" = []
+context_type_to_style_sheet: "dict[type, ContextStyleSheet | None]" = {}
+
+
+def register_context_style_sheets():
+    context_style_sheets.extend([
+        ContextStyleSheet(aqt.deckbrowser.DeckBrowser, "deck_browser.css"),
+        ContextStyleSheet(aqt.editor.Editor, "editor.css", is_altered_editor),
+    ])
+
+
+def get_context_style_sheet(context) -> "ContextStyleSheet | None":
+    context_type = type(context)
+
+    try:
+        return context_type_to_style_sheet[context_type]
+    except KeyError:
+        style_sheet = context_type_to_style_sheet[context_type] = next(
+            (style_sheet for style_sheet in context_style_sheets
+             if issubclass(context_type, style_sheet.context_class)),
+            None
+        )
+        return style_sheet
+
 
-    if isinstance(context, aqt.editor.Editor):
-        if context.parentWindow.__class__.__name__ in ALTERED_DIALOGS_CLASS_NAMES:
-            web_content.head += """<style>
-                body {background: none !important }
-                .sticky-container, .container-fluid { background: none !important }
-            </style>"""
+def webview_will_set_content(web_content: "aqt.webview.WebContent", context):
+    style_sheet = get_context_style_sheet(context)
+
+    if style_sheet and style_sheet.applies_to(context):
+        addon_package = aqt.mw.addonManager.addonFromModule(__name__)
+        web_content.css.append(f"/_addons/{addon_package}/web/{style_sheet.file_name}")
 
 
 ########################################################################################
@@ -197,11 +277,29 @@ def next_wallpaper():
     config.next_wallpaper()
     set_wallpapers_now()
 
-# View menu on Anki 2.1.50+, Tools menu if View menu not available
-def setup_next_wallpaper_menu():
+# Wallpapers that were prefetched as neighbours of the previous wallpaper
+# may have been skipped over; they are not needed anymore
+def on_wallpaper_switched():
+    cancel_prefetching_except([wallpaper.url for wallpaper
+                               in [config.current_wallpaper, *get_neighbouring_wallpapers()]])
+    set_wallpapers_now()
+    slideshow.restart()
+
+def on_theme_did_change():
+    config.switch_to_paired_wallpaper()
+    set_wallpapers_now()
+
+# View menu on Anki 2.1.50+, Tools menu if View menu not available.
+# The actions go through `wallpaper_switcher`, so that rapid presses are added up.
+def setup_wallpaper_menu():
     menu_next_wallpaper = QAction("Next wallpaper", aqt.mw, shortcut="Ctrl+Shift+W")  # noqa
     menu_next_wallpaper.setShortcutContext(Qt.ShortcutContext.ApplicationShortcut)
-    menu_next_wallpaper.triggered.connect(next_wallpaper)  # noqa
+    menu_next_wallpaper.triggered.connect(lambda: wallpaper_switcher.switch(1))  # noqa
+
+    menu_previous_wallpaper = QAction("Previous wallpaper", aqt.mw,  # noqa
+                                      shortcut="Ctrl+Alt+Shift+W")
+    menu_previous_wallpaper.setShortcutContext(Qt.ShortcutContext.ApplicationShortcut)
+    menu_previous_wallpaper.triggered.connect(lambda: wallpaper_switcher.switch(-1))  # noqa
 
     try:
         menu = aqt.mw.form.menuqt_accel_view
@@ -210,23 +308,170 @@ def setup_next_wallpaper_menu():
 
     menu.addSeparator()
     menu.addAction(menu_next_wallpaper)
+    menu.addAction(menu_previous_wallpaper)
+
+
+# Makes the variants that are missing, e.g. for files that were just added.
+# The ones that exist are already used, see `Config.load_wallpapers`,
+# so unless some were made, the wallpapers don't change.
+def downscale_large_wallpapers():
+    wallpapers = config.wallpapers
+    max_size = get_largest_screen_size()
+
+    def downscale():
+        return wallpapers.with_variants(
+            lambda wallpapers_: get_wallpapers_with_downscaled_variants(wallpapers_, max_size)
+        )
+
+    def on_downscaled(future):
+        if config.wallpapers is wallpapers and (downscaled := future.result()) != wallpapers:
+            config.wallpapers = downscaled
+            set_wallpapers_now()
+
+    aqt.mw.taskman.run_in_background(downscale, on_downscaled)
+
+
+def on_wallpapers_loaded():
+    set_wallpapers_now()
+
+    if config.downscale_large_wallpapers:
+        downscale_large_wallpapers()
+
+
+def apply_settings():
+    profiler.enabled = config.collect_timings
+    pixmap_cache.set_size_limit(config.image_cache_size_in_megabytes * 1024 * 1024)
+    slideshow.set_interval(config.slideshow_interval_minutes)
+
+
+def on_config_loaded():
+    apply_settings()
+    folder_watcher.watch(config.folder_with_wallpapers)
+    on_wallpapers_loaded()
+
+
+# The `enabled_for` tag that a wallpapered widget is subject to
+def get_enabled_for_tag(widget: QWidget, kind: str) -> "str | None":
+    if kind == MAIN_WINDOW:
+        return configuration.MAIN_WINDOW
+    elif kind == PREVIEWER:
+        return configuration.PREVIEWER
+    else:
+        return configuration.dialog_class_name_to_tag.get(widget.__class__.__name__)
+
+
+# If the wallpaper folder hasn't changed, only the windows that the changes concern
+# are updated: all of them if a different wallpaper is to be shown, or scaled differently;
+# or only those that were enabled or disabled.
+def on_config_changed(changes: "ConfigChanges | None"):
+    if changes is None:
+        on_config_loaded()
+        return
 
+    apply_settings()
 
-config = Config()
-config.load()
+    if changes.indexes_changed or SCALING in changes.keys:
+        set_wallpapers_now()
+    elif changes.enabled_for_tags:
+        set_wallpapers_now([
+            (widget, kind) for widget, kind in wallpapered_widgets.get_widgets()
+            if get_enabled_for_tag(widget, kind) in changes.enabled_for_tags
+        ])
+
+
+def on_folder_with_wallpapers_changed():
+    config.reload_wallpapers(on_done=on_wallpapers_loaded)
+
+
+########################################################################### setting up
+
+
+# Only the hooks are registered when the add-on is imported; the rest is done later.
+# Methods are patched when the collection is loaded, which happens
+# right before the main window shows its first page; by then, Anki has imported
+# the modules that are patched anyway. The config is loaded, and the folder
+# with wallpapers is scanned, when the profile is opened.
+# As the profile can be closed and opened again, all of this must only be done once.
+
+patches_installed = False
+profile_set_up = False
+
+
+def install_patches():
+    global patches_installed
+    if patches_installed:
+        return
+    patches_installed = True
+
+    import aqt.addcards
+    import aqt.browser.previewer
+    import aqt.deckbrowser  # used by `webview_will_set_content`
+    import aqt.editor
+    import aqt.webview
+
+    prepend_to_method(aqt.editor.EditorWebView, "__init__")(editor_webview_init)
+    replace_method(aqt.webview.AnkiWebView, "get_window_bg_color")(webview_get_window_bg_color)
+    append_to_method(aqt.browser.previewer.Previewer, "__init__")(previewer_init)
+    append_to_method(aqt.browser.previewer.Previewer, "show")(previewer_show)
+    append_to_method(aqt.addcards.AddCards, "__init__")(add_cards_init)
+    append_to_method(aqt.editor.Editor, "setupWeb")(editor_init)
+
+    register_context_style_sheets()
+
+
+def set_up_on_profile_open():
+    global profile_set_up, folder_watcher, slideshow
+    if profile_set_up:
+        return
+    profile_set_up = True
+
+    folder_watcher = FolderWatcher(aqt.mw, on_folder_with_wallpapers_changed)
+    slideshow = Slideshow(aqt.mw, prefetch=prefetch_neighbouring_wallpapers,
+                          switch=next_wallpaper)
+    wallpapered_widgets.add(aqt.mw, MAIN_WINDOW)
+    setup_wallpaper_menu()
+    config.load(on_done=on_config_loaded)
+
+
+def on_collection_did_load(_collection):
+    with profiler.measuring_always("startup: installing patches"):
+        install_patches()
+
+
+def on_profile_did_open():
+    with profiler.measuring_always("startup: setting up"):
+        set_up_on_profile_open()
+
+
+# Startup is always measured, as the config is not loaded yet at that time,
+# but only reported along with the rest of the timings
+def on_profile_will_close():
+    config.save_indexes()
+    if profiler.enabled:
+        profiler.dump()
+
+
+config = Config(make_anki_environment())
+wallpaper_switcher = WallpaperSwitcher(config, on_switched=on_wallpaper_switched)
+folder_watcher: "FolderWatcher | None" = None
+slideshow: "Slideshow | None" = None
 
 
 @run_on_configuration_change
 def on_configuration_change():
-    config.load()
-    set_wallpapers_now()
+    config.load_changes(on_done=on_config_changed)
 
 
 if anki_version >= (2, 1, 50):
-    gui_hooks.theme_did_change.append(set_wallpapers_now)
+    gui_hooks.theme_did_change.append(timed("theme_did_change hook")(on_theme_did_change))
 
-gui_hooks.webview_will_set_content.append(webview_will_set_content)
+aqt.mw.addonManager.setWebExports(__name__, WEB_EXPORTS_PATTERN)
+gui_hooks.webview_will_set_content.append(
+    timed("webview_will_set_content hook")(webview_will_set_content)
+)
+gui_hooks.collection_did_load.append(on_collection_did_load)
+gui_hooks.profile_did_open.append(on_profile_did_open)
+gui_hooks.profile_will_close.append(on_profile_will_close)
 
 
-setup_next_wallpaper_menu()
-set_wallpapers_now()
+profiler.add("startup: importing", time.perf_counter() - import_start_time)
@@ -0,0 +1,103 @@
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, replace
+from pathlib import Path
+
+import aqt
+import aqt.theme
+from aqt.qt import QImageReader, QTimer
+from aqt.utils import showWarning
+
+from .configuration import Environment, Wallpaper
+from .variants import get_largest_screen_size, get_wallpapers_with_downscaled_variants
+
+
+def is_dark_mode():
+    return aqt.theme.theme_manager.night_mode
+
+
+def read_config():
+    return aqt.mw.addonManager.getConfig(__name__)
+
+def write_config(data):
+    aqt.mw.addonManager.writeConfig(__name__, data)
+
+
+def run_on_configuration_change(function):
+    aqt.mw.addonManager.setConfigUpdatedAction(__name__, lambda *_: function())
+
+
+def show_warning(text):
+    showWarning(title="Wallpaper", text=text, help=None)  # noqa
+
+
+def run_in_background(task, on_done):
+    aqt.mw.taskman.run_in_background(task, on_done)
+
+
+def make_timer(interval_in_milliseconds, callback):
+    timer = QTimer(aqt.mw)
+    timer.setSingleShot(True)
+    timer.setInterval(interval_in_milliseconds)
+    timer.timeout.connect(callback)  # noqa
+    return timer
+
+
+def make_variant_finder():
+    max_size = get_largest_screen_size()
+
+    def find_variants(wallpapers):
+        return get_wallpapers_with_downscaled_variants(wallpapers, max_size,
+                                                       make_missing=False)
+
+    return find_variants
+
+
+########################################################################################
+
+
+# Only reads the header of the file, to see whether Qt will be able to decode it.
+# The size of the image is kept, so that it is known without opening the file again.
+# Returns (metadata, error); metadata is `None` if the file can't be used.
+# Files that don't look like images at all, such as `Thumbs.db`, are skipped silently.
+def describe_wallpaper_file(file: Path):
+    reader = QImageReader(str(file))
+
+    if reader.canRead() and (size := reader.size()).isValid():
+        wallpaper = replace(Wallpaper.from_file_path(file),
+                            width=size.width(), height=size.height())
+        return asdict(wallpaper), None
+
+    if reader.error() != QImageReader.ImageReaderError.UnsupportedFormatError:
+        return None, f"Error reading file '{file}': {reader.errorString()}"
+
+    if file.suffix.lower().lstrip(".") in get_supported_image_formats():
+        return None, f"File is not a valid image: '{file}'"
+
+    return None, None
+
+
+def get_supported_image_formats():
+    return {bytes(image_format).decode() for image_format in QImageReader.supportedImageFormats()}
+
+
+# Called by the folder index for new and changed files only, so that the results,
+# including any errors, are remembered until the files change again.
+def describe_wallpaper_files(files: "list[Path]"):
+    with ThreadPoolExecutor() as executor:
+        return list(executor.map(describe_wallpaper_file, files))
+
+
+########################################################################################
+
+
+def make_anki_environment() -> Environment:
+    return Environment(
+        read_config=read_config,
+        write_config=write_config,
+        is_dark_mode=is_dark_mode,
+        show_warning=show_warning,
+        describe_files=describe_wallpaper_files,
+        run_in_background=run_in_background,
+        make_timer=make_timer,
+        make_variant_finder=make_variant_finder,
+    )
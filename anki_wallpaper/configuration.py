@@ -1,15 +1,10 @@
 import re
 from contextlib import contextmanager
-from dataclasses import dataclass
+from dataclasses import dataclass, field, replace
 from pathlib import Path
+from typing import Callable
 
-import aqt
-import aqt.browser.previewer
-import aqt.deckbrowser
-import aqt.editor
-import aqt.theme
-import aqt.webview
-from aqt.utils import showWarning
+from .folder_index import get_indexed_files
 
 
 # configuration keys
@@ -17,6 +12,11 @@ FOLDER_WITH_WALLPAPERS = "folder_with_wallpapers"
 ENABLED_FOR = "enabled_for"
 LIGHT_WALLPAPER_INDEX = "light_wallpaper_index"
 DARK_WALLPAPER_INDEX = "dark_wallpaper_index"
+IMAGE_CACHE_SIZE_IN_MEGABYTES = "image_cache_size_in_megabytes"
+SCALING = "scaling"
+DOWNSCALE_LARGE_WALLPAPERS = "downscale_large_wallpapers"
+COLLECT_TIMINGS = "collect_timings"
+SLIDESHOW_INTERVAL_MINUTES = "slideshow_interval_minutes"
 
 # enabled_for tags
 MAIN_WINDOW = "main_window"
@@ -32,26 +32,41 @@ tag_to_dialog_class_name = {
     EDIT: "Edit",
 }
 
-
-def is_dark_mode():
-    return aqt.theme.theme_manager.night_mode
-
-
-def read_config():
-    return aqt.mw.addonManager.getConfig(__name__)
-
-def write_config(data):
-    aqt.mw.addonManager.writeConfig(__name__, data)
-
-@contextmanager
-def editing_config():
-    data = read_config()
-    yield data
-    write_config(data)
+dialog_class_name_to_tag = {
+    class_name: tag for tag, class_name in tag_to_dialog_class_name.items()
+}
 
 
-def run_on_configuration_change(function):
-    aqt.mw.addonManager.setConfigUpdatedAction(__name__, lambda *_: function())
+# Everything that the configuration needs from Anki and Qt.
+# This module doesn't import either, so that it can be tested without Anki running;
+# the real environment is made by `anki_environment.make_anki_environment()`.
+#
+# * `describe_files` is called with a list of paths of new and changed files
+#   in the wallpaper folder, and returns a list of (metadata, error) pairs,
+#   see `anki_environment.describe_wallpaper_file()`;
+# * `run_in_background` is called with a task and a callback,
+#   which is called on the main thread with a future, like Anki's `taskman`;
+# * `make_timer` is called with an interval in milliseconds and a callback,
+#   and returns a single-shot timer with `start()` and `stop()`;
+# * `make_variant_finder` is called on the main thread, and returns a function
+#   that can be called in the background with a list of wallpapers;
+#   it returns them with the urls of the ones that have downscaled variants replaced.
+@dataclass
+class Environment:
+    read_config: Callable[[], dict]
+    write_config: Callable[[dict], None]
+    is_dark_mode: Callable[[], bool]
+    show_warning: Callable[[str], None]
+    describe_files: Callable
+    run_in_background: Callable
+    make_timer: Callable
+    make_variant_finder: Callable
+
+    @contextmanager
+    def editing_config(self):
+        data = self.read_config()
+        yield data
+        self.write_config(data)
 
 
 ########################################################################################
@@ -87,16 +102,20 @@ class IsEnabled:
 
 # Qt doesn't seem to like `file://` URLs, nor it likes backslashes in any form.
 # Therefore on both Linux and Windows `url` is a Posix path, as in `C:/Foo/Bar`.
+# If `url` points to a downscaled variant of the wallpaper, `source_url` is the original.
+# `width` and `height` are those of the original, or 0 if they are not known.
 @dataclass
 class Wallpaper:
     url: str
     position: str
     dark: bool
+    source_url: "str | None" = None
+    width: int = 0
+    height: int = 0
 
     @classmethod
     def from_file_path(cls, file_path: Path):
-        file_name_without_extension = file_path.name.rsplit(".", 1)[0]
-        file_name_parts = re.split(r"[-_. ]", file_name_without_extension)
+        file_name_parts = get_file_name_parts(file_path.name)
 
         url = file_path.absolute().as_posix()
 
@@ -110,38 +129,47 @@ class Wallpaper:
 Wallpaper.missing = Wallpaper("", "center", False)
 
 
+def get_file_name_parts(file_name: str) -> "list[str]":
+    file_name_without_extension = file_name.rsplit(".", 1)[0]
+    return re.split(r"[-_. ]", file_name_without_extension)
+
+
+# Light and dark wallpapers whose file names only differ in `dark`,
+# such as `puppy.png` and `puppy.dark.png`, or `sky-top.jpg` and `sky_dark-top.jpg`,
+# are variants of the same wallpaper, and have the same pairing key.
+def get_pairing_key(wallpaper: Wallpaper) -> str:
+    file_name = (wallpaper.source_url or wallpaper.url).rsplit("/", 1)[-1]
+    return " ".join(part for part in get_file_name_parts(file_name) if part != "dark")
+
+
+# `light_to_dark` and `dark_to_light` map indexes of paired wallpapers
 @dataclass
 class Wallpapers:
     light: "list[Wallpaper]"
     dark: "list[Wallpaper]"
     errors: "list[str]"
+    light_to_dark: "dict[int, int]" = field(default_factory=dict)
+    dark_to_light: "dict[int, int]" = field(default_factory=dict)
 
     @classmethod
-    def from_data(cls, data):
+    def from_data(cls, data, describe_files):
         result = cls([], [], [])
 
         folder = Path(data[FOLDER_WITH_WALLPAPERS])
 
         try:
-            files = [path.absolute() for path in folder.iterdir() if path.is_file()]
+            files = get_indexed_files(folder, describe_files)
         except Exception as e:
             result.errors.append(f"Error opening wallpaper folder '{folder}': {e}")
         else:
-            files_to_validate_via_opening = \
-                files if len(files) < 10 else files[:5] + files[-5:]
+            for file in files:
+                if file.error:
+                    result.errors.append(file.error)
 
-            for file in sorted(files):
-                if '"' in str(file):
-                    result.errors.append(f"File path contains quotes: '{file}'")
+                if file.metadata is None:
+                    continue
 
-                if file in files_to_validate_via_opening:
-                    try:
-                        with file.open():
-                            pass
-                    except Exception as e:
-                        result.errors.append(f"Error opening file '{file}': {e}")
-
-                wallpaper = Wallpaper.from_file_path(file)
+                wallpaper = Wallpaper(**file.metadata)
                 (result.dark if wallpaper.dark else result.light).append(wallpaper)
 
             if not result.light:
@@ -149,14 +177,47 @@ class Wallpapers:
             if not result.dark:
                 result.errors.append(f"Folder does not contain dark wallpapers: '{folder}'")
 
+            result.pair_light_and_dark_wallpapers()
+
         return result
 
+    def pair_light_and_dark_wallpapers(self):
+        pairing_key_to_light_index = {}
+        for index, wallpaper in enumerate(self.light):
+            pairing_key_to_light_index.setdefault(get_pairing_key(wallpaper), index)
+
+        for dark_index, wallpaper in enumerate(self.dark):
+            light_index = pairing_key_to_light_index.get(get_pairing_key(wallpaper))
+            if light_index is not None and light_index not in self.light_to_dark:
+                self.light_to_dark[light_index] = dark_index
+                self.dark_to_light[dark_index] = light_index
+
+    # `get_variants` is called with all wallpapers, and returns them with other urls
+    def with_variants(self, get_variants) -> "Wallpapers":
+        wallpapers = get_variants([*self.light, *self.dark])
+        return replace(
+            self,
+            light=[wallpaper for wallpaper in wallpapers if not wallpaper.dark],
+            dark=[wallpaper for wallpaper in wallpapers if wallpaper.dark],
+        )
 
-def change_folder_with_wallpapers_setting_to_sample_folder():
+    # Returns the index of the wallpaper made from the same file, or `default`
+    def find(self, wallpaper: Wallpaper, default: int) -> int:
+        source_url = wallpaper.source_url or wallpaper.url
+        wallpapers = self.dark if wallpaper.dark else self.light
+
+        for index, other_wallpaper in enumerate(wallpapers):
+            if (other_wallpaper.source_url or other_wallpaper.url) == source_url:
+                return index
+
+        return default
+
+
+def change_folder_with_wallpapers_setting_to_sample_folder(environment: Environment):
     this_file_folder = Path(__file__).parent
     sample_wallpapers_folder = this_file_folder / "sample_wallpapers"
 
-    with editing_config() as data:
+    with environment.editing_config() as data:
         data[FOLDER_WITH_WALLPAPERS] = str(sample_wallpapers_folder)
 
 
@@ -172,52 +233,328 @@ class Indexes:
     def from_data(cls, data):
         return cls(data[LIGHT_WALLPAPER_INDEX], data[DARK_WALLPAPER_INDEX])
 
+    def to_data(self, data):
+        data[LIGHT_WALLPAPER_INDEX] = self.light
+        data[DARK_WALLPAPER_INDEX] = self.dark
+
+    # Indexes are kept within bounds, so that they can be used without wrapping around.
+    # If there are no wallpapers, the index is kept as is.
+    def normalized(self, wallpapers: Wallpapers) -> "Indexes":
+        def normalize(index, wallpapers_):
+            return index % len(wallpapers_) if wallpapers_ else index
+
+        return Indexes(normalize(self.light, wallpapers.light),
+                       normalize(self.dark, wallpapers.dark))
+
+
+# Writing the config is not instant, and it would be done on every wallpaper change.
+# Instead, the indexes are saved after they haven't changed for a while,
+# and also when the profile is closed.
+SAVE_INDEXES_DELAY_MILLISECONDS = 5000
+
+# Next and Previous wallpaper can be pressed rapidly, or held down.
+# Switching is done after they haven't been pressed for this long.
+SWITCH_WALLPAPER_DELAY_MILLISECONDS = 200
+
 
 ########################################################################################
 
 
-def show_warning_about_wallpaper_folder_config_errors(errors):
+# Changing these settings changes the wallpapers themselves, or their urls
+WALLPAPERS_KEYS = [FOLDER_WITH_WALLPAPERS, DOWNSCALE_LARGE_WALLPAPERS]
+
+
+# What has changed when the config was edited, other than the wallpapers.
+# `enabled_for_tags` are the tags that were either added or removed.
+@dataclass
+class ConfigChanges:
+    keys: "set[str]"
+    enabled_for_tags: "set[str]"
+    indexes_changed: bool
+
+    @classmethod
+    def between(cls, old_data, new_data, indexes_changed):
+        return cls(
+            keys={key for key in new_data if new_data[key] != old_data.get(key)},
+            enabled_for_tags={*old_data[ENABLED_FOR]} ^ {*new_data[ENABLED_FOR]},
+            indexes_changed=indexes_changed,
+        )
+
+
+def get_warning_about_wallpaper_folder_config_errors(errors):
     errors_str = '\n'.join(errors)
 
-    showWarning(
-        title="Wallpaper",
-        text="Hello, this is the Wallpaper add-on! "
-             "I have some issues with the wallpaper folder setting. "
-             "Things will probably break. Sorry! "
-             "(It's probably your fault, though.)"
-             "\n\n"
-             f"{errors_str}",
-        help=None,  # noqa
-    )
+    return "Hello, this is the Wallpaper add-on! " \
+           "I have some issues with the wallpaper folder setting. " \
+           "Things will probably break. Sorry! " \
+           "(It's probably your fault, though.)" \
+           "\n\n" \
+           f"{errors_str}"
 
 
 class Config:
-    def __init__(self):
+    def __init__(self, environment: Environment):
+        self.environment = environment
         self.is_enabled = IsEnabled(False, False, [])
         self.wallpapers = Wallpapers([], [], [])
         self.indexes = Indexes(0, 0)
-
-    def load(self):
-        data = read_config()
+        self.saved_indexes = Indexes(0, 0)
+        self.save_indexes_timer = None
+        self.image_cache_size_in_megabytes = 0
+        self.scaling = "none"
+        self.downscale_large_wallpapers = False
+        self.collect_timings = False
+        self.slideshow_interval_minutes = 0
+        self.folder_with_wallpapers = None
+        self.data: "dict | None" = None
+        self.load_generation = 0
+        self.load_is_pending = False
+        self.rescan_generation = 0
+        self.queued_rescan: "Callable[[], None] | None" = None
+
+    # Until the folder is scanned, the previous wallpapers stay in use;
+    # then the new ones are swapped in on the main thread, and `on_done` is called.
+    # If this is called again in the meantime, the results of the older call are dropped.
+    def load(self, on_done=None):
+        data = self.environment.read_config()
 
         if data[FOLDER_WITH_WALLPAPERS] == "change_me":
-            change_folder_with_wallpapers_setting_to_sample_folder()
-            data = read_config()
+            change_folder_with_wallpapers_setting_to_sample_folder(self.environment)
+            data = self.environment.read_config()
 
-        self.is_enabled = IsEnabled.from_data(data)
-        self.wallpapers = Wallpapers.from_data(data)
-        self.indexes = Indexes.from_data(data)
+        self.load_generation += 1
+        self.load_is_pending = True
+        load_generation = self.load_generation
+
+        def on_wallpapers_loaded(wallpapers):
+            if load_generation != self.load_generation:
+                return
+
+            self.load_is_pending = False
+            self.wallpapers = wallpapers
+            self.apply_data(data)
+
+            if self.wallpapers.errors:
+                self.environment.show_warning(
+                    get_warning_about_wallpaper_folder_config_errors(self.wallpapers.errors)
+                )
+
+            if on_done is not None:
+                on_done()
+
+            self.run_queued_rescan()
 
-        if self.wallpapers.errors:
-            show_warning_about_wallpaper_folder_config_errors(self.wallpapers.errors)
+        self.load_wallpapers(data, on_wallpapers_loaded)
 
-    def next_wallpaper(self):
-        with editing_config() as data:
-            data[DARK_WALLPAPER_INDEX if is_dark_mode() else LIGHT_WALLPAPER_INDEX] += 1
-        self.indexes = Indexes.from_data(data)
+    # Used when the config was edited by the user. The folder is only scanned again
+    # if the settings that wallpapers depend on have changed, in which case
+    # this is the same as `load()`, and `on_done` is called with `None`.
+    # Otherwise, the new settings are applied right away,
+    # and `on_done` is called with what has changed.
+    def load_changes(self, on_done: "Callable[[ConfigChanges | None], None]"):
+        data = self.environment.read_config()
+
+        if self.data is None or any(data[key] != self.data[key] for key in WALLPAPERS_KEYS):
+            self.load(on_done=lambda: on_done(None))
+            return
+
+        # A scan of a folder that is no longer in the config might be still running.
+        # Rescans of the current folder are not affected.
+        if self.load_is_pending:
+            self.load_generation += 1
+            self.load_is_pending = False
+
+        previous_data = self.data
+        previous_indexes = self.indexes
+        self.apply_data(data)
+
+        on_done(ConfigChanges.between(previous_data, data,
+                                      indexes_changed=self.indexes != previous_indexes))
+
+        self.run_queued_rescan()
+
+    # Applies everything but the wallpapers, which must be already loaded.
+    # The indexes in the config can be older than the ones in memory.
+    # Only use them if they were changed by the user.
+    def apply_data(self, data):
+        indexes = Indexes.from_data(data)
+        if indexes != self.saved_indexes:
+            self.indexes = self.saved_indexes = indexes
+
+        self.is_enabled = IsEnabled.from_data(data)
+        self.image_cache_size_in_megabytes = data[IMAGE_CACHE_SIZE_IN_MEGABYTES]
+        self.scaling = data[SCALING]
+        self.downscale_large_wallpapers = data[DOWNSCALE_LARGE_WALLPAPERS]
+        self.collect_timings = data[COLLECT_TIMINGS]
+        self.slideshow_interval_minutes = data[SLIDESHOW_INTERVAL_MINUTES]
+        self.folder_with_wallpapers = data[FOLDER_WITH_WALLPAPERS]
+        self.indexes = self.indexes.normalized(self.wallpapers)
+        self.data = data
+
+    # Used when files in the wallpaper folder were added, removed or renamed.
+    # Thanks to the folder index, only the changed files are looked at.
+    # Current wallpapers stay the same if they are still in the folder.
+    # Errors are not shown here, as the files might be still being copied;
+    # if they persist, they will be shown when the config is loaded again.
+    #
+    # Rescans are independent of full loads. While a full load is pending,
+    # the folder might be about to change, so rescans are done after it;
+    # a newer rescan drops the results of the older ones.
+    def reload_wallpapers(self, on_done=None):
+        if self.folder_with_wallpapers is None:
+            return
+
+        if self.load_is_pending:
+            self.queued_rescan = lambda: self.reload_wallpapers(on_done)
+            return
+
+        self.rescan_generation += 1
+        rescan_generation = self.rescan_generation
+
+        def on_wallpapers_reloaded(wallpapers):
+            if rescan_generation != self.rescan_generation:
+                return
+
+            if self.load_is_pending:
+                self.queued_rescan = lambda: self.reload_wallpapers(on_done)
+                return
+
+            light_wallpaper = self.get_wallpaper(dark=False)
+            dark_wallpaper = self.get_wallpaper(dark=True)
+
+            self.wallpapers = wallpapers
+            self.indexes = Indexes(
+                wallpapers.find(light_wallpaper, default=self.indexes.light),
+                wallpapers.find(dark_wallpaper, default=self.indexes.dark),
+            ).normalized(wallpapers)
+            self.schedule_saving_indexes()
+
+            if on_done is not None:
+                on_done()
+
+        self.load_wallpapers({FOLDER_WITH_WALLPAPERS: self.folder_with_wallpapers,
+                              DOWNSCALE_LARGE_WALLPAPERS: self.downscale_large_wallpapers},
+                             on_wallpapers_reloaded)
+
+    def run_queued_rescan(self):
+        if self.queued_rescan is not None:
+            queued_rescan, self.queued_rescan = self.queued_rescan, None
+            queued_rescan()
+
+    # Scanning the folder may take a while, so it is done in the background.
+    # Downscaled variants that were made before are used right away, so that
+    # large originals are not even decoded; missing variants are made later.
+    def load_wallpapers(self, data, on_loaded):
+        find_variants = self.environment.make_variant_finder() \
+            if data[DOWNSCALE_LARGE_WALLPAPERS] else None
+
+        def load():
+            wallpapers = Wallpapers.from_data(data, self.environment.describe_files)
+            if find_variants is not None:
+                wallpapers = wallpapers.with_variants(find_variants)
+            return wallpapers
+
+        self.environment.run_in_background(load, lambda future: on_loaded(future.result()))
+
+    # Offset is relative to the current wallpaper, e.g. -1 for the previous one
+    def next_wallpaper(self, offset=1):
+        if self.environment.is_dark_mode():
+            self.indexes = replace(self.indexes, dark=self.indexes.dark + offset)
+        else:
+            self.indexes = replace(self.indexes, light=self.indexes.light + offset)
+        self.indexes = self.indexes.normalized(self.wallpapers)
+        self.schedule_saving_indexes()
+
+    # Called after the theme was changed. If the wallpaper of the previous theme
+    # has a variant for the new theme, the variant is shown, so that switching
+    # between light and dark mode keeps showing the same picture.
+    def switch_to_paired_wallpaper(self):
+        if self.environment.is_dark_mode():
+            dark_index = self.wallpapers.light_to_dark.get(self.indexes.light)
+            if dark_index is not None and dark_index != self.indexes.dark:
+                self.indexes = replace(self.indexes, dark=dark_index)
+                self.schedule_saving_indexes()
+        else:
+            light_index = self.wallpapers.dark_to_light.get(self.indexes.dark)
+            if light_index is not None and light_index != self.indexes.light:
+                self.indexes = replace(self.indexes, light=light_index)
+                self.schedule_saving_indexes()
+
+    def schedule_saving_indexes(self):
+        if self.save_indexes_timer is None:
+            self.save_indexes_timer = self.environment.make_timer(
+                SAVE_INDEXES_DELAY_MILLISECONDS, self.save_indexes
+            )
+        self.save_indexes_timer.start()
+
+    def save_indexes(self):
+        if self.save_indexes_timer is not None:
+            self.save_indexes_timer.stop()
+
+        if self.indexes != self.saved_indexes:
+            with self.environment.editing_config() as data:
+                self.indexes.to_data(data)
+            self.saved_indexes = self.indexes
+
+    # Offset is relative to the current wallpaper, e.g. 1 for the next one.
+    # Unless specified, the wallpaper is for the current theme.
+    def get_wallpaper(self, offset=0, dark=None):
+        dark = self.environment.is_dark_mode() if dark is None else dark
+        wallpapers = self.wallpapers.dark if dark else self.wallpapers.light
+        index = self.indexes.dark if dark else self.indexes.light
+
+        if not wallpapers:
+            return Wallpaper.missing
+        if offset:
+            index = (index + offset) % len(wallpapers)
+        return wallpapers[index]
 
     @property
     def current_wallpaper(self):
-        wallpapers = self.wallpapers.dark if is_dark_mode() else self.wallpapers.light
-        index = self.indexes.dark if is_dark_mode() else self.indexes.light
-        return wallpapers[index % len(wallpapers)] if wallpapers else Wallpaper.missing
+        return self.get_wallpaper()
+
+    # The variant of the current wallpaper for the other theme, if any
+    def get_paired_wallpaper(self) -> "Wallpaper | None":
+        if self.environment.is_dark_mode():
+            light_index = self.wallpapers.dark_to_light.get(self.indexes.dark)
+            return None if light_index is None else self.wallpapers.light[light_index]
+        else:
+            dark_index = self.wallpapers.light_to_dark.get(self.indexes.light)
+            return None if dark_index is None else self.wallpapers.dark[dark_index]
+
+
+########################################################################################
+
+
+# Presses of Next and Previous wallpaper that come in quick succession are added up,
+# and only the wallpaper they add up to is switched to, once they stop,
+# so that the wallpapers in between are neither decoded nor shown.
+# `on_switched` is called after the wallpaper was switched.
+class WallpaperSwitcher:
+    def __init__(self, config: Config, on_switched: Callable[[], None]):
+        self.config = config
+        self.on_switched = on_switched
+        self.offset = 0
+        self.timer = None
+
+    def switch(self, offset: int):
+        self.offset += offset
+
+        if self.timer is None:
+            self.timer = self.config.environment.make_timer(
+                SWITCH_WALLPAPER_DELAY_MILLISECONDS, self.switch_now
+            )
+        self.timer.start()
+
+    def switch_now(self):
+        if self.timer is not None:
+            self.timer.stop()
+
+        offset, self.offset = self.offset, 0
+        indexes = self.config.indexes
+
+        if offset:
+            self.config.next_wallpaper(offset)
+
+        if self.config.indexes != indexes:
+            self.on_switched()
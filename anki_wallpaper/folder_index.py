@@ -0,0 +1,133 @@
+import json
+import os
+import threading
+import time
+from dataclasses import dataclass, asdict
+from pathlib import Path
+
+
+# The index is stored in `user_files`, which Anki preserves when updating the add-on.
+# It only ever holds one folder, the one that was scanned last.
+INDEX_FILE_PATH = Path(__file__).parent / "user_files" / "folder_index.json"
+INDEX_VERSION = 3
+
+# The mtime of a directory changes when entries are added, removed or renamed.
+# Some file systems, network ones in particular, only store it with the precision
+# of a second or two; if a file is added in the same tick that the folder is scanned,
+# the mtime won't change. So if the folder was modified very recently,
+# we don't trust its mtime and make the next load look at the entries again.
+RACY_MTIME_SECONDS = 2
+
+
+@dataclass
+class IndexedFile:
+    name: str
+    size: int
+    mtime: int
+    metadata: "dict | None"
+    error: "str | None" = None
+
+
+@dataclass
+class FolderIndex:
+    folder: str
+    mtime: "int | None"
+    files: "list[IndexedFile]"
+
+    @classmethod
+    def from_json(cls, data):
+        if data.get("version") != INDEX_VERSION:
+            raise ValueError(f"Unsupported index version: {data.get('version')}")
+        files = [IndexedFile(**file) for file in data["files"]]
+        return cls(data["folder"], data["mtime"], files)
+
+    def to_json(self):
+        return {"version": INDEX_VERSION, **asdict(self)}
+
+
+########################################################################################
+
+
+lock = threading.Lock()
+index_in_memory: "FolderIndex | None" = None
+
+
+def read_index() -> "FolderIndex | None":
+    global index_in_memory
+
+    if index_in_memory is None:
+        try:
+            with INDEX_FILE_PATH.open(encoding="utf-8") as file:
+                index_in_memory = FolderIndex.from_json(json.load(file))
+        except Exception:  # missing, corrupt or outdated; it's only a cache anyway
+            pass
+
+    return index_in_memory
+
+
+def write_index(index: FolderIndex):
+    global index_in_memory
+    index_in_memory = index
+
+    temporary_file_path = INDEX_FILE_PATH.with_suffix(".tmp")
+
+    try:
+        INDEX_FILE_PATH.parent.mkdir(exist_ok=True)
+        with temporary_file_path.open("w", encoding="utf-8") as file:
+            json.dump(index.to_json(), file)
+        os.replace(temporary_file_path, INDEX_FILE_PATH)
+    except OSError:  # e.g. the add-on folder is read-only; we'll just rescan next time
+        pass
+
+
+########################################################################################
+
+
+# Returns the files in the folder, sorted by name. If the mtime of the folder
+# is the same as the one in the index, this costs a single `stat`.
+# Otherwise, the folder is listed, and only the files that are new,
+# or whose size or mtime changed, are passed to `describe_files`.
+# It takes a list of paths and must return a list of (metadata, error) pairs.
+# Metadata can be `None` for files that are not to be used.
+def get_indexed_files(folder: Path, describe_files) -> "list[IndexedFile]":
+    folder = folder.absolute()
+    folder_mtime = folder.stat().st_mtime_ns
+
+    with lock:
+        index = read_index()
+
+        if index is None or index.folder != str(folder):
+            index = FolderIndex(str(folder), None, [])
+        elif index.mtime == folder_mtime:
+            return index.files
+
+        known_files = {file.name: file for file in index.files}
+        files = []
+        changed_files = []
+
+        with os.scandir(folder) as dir_entries:
+            for dir_entry in dir_entries:
+                if not dir_entry.is_file():
+                    continue
+
+                stat = dir_entry.stat()
+                file = known_files.get(dir_entry.name)
+
+                if file is None or file.size != stat.st_size or file.mtime != stat.st_mtime_ns:
+                    file = IndexedFile(dir_entry.name, stat.st_size, stat.st_mtime_ns, None)
+                    changed_files.append(file)
+
+                files.append(file)
+
+        files.sort(key=lambda file: file.name)
+        changed_files.sort(key=lambda file: file.name)
+
+        descriptions = describe_files([folder / file.name for file in changed_files])
+        for file, (metadata, error) in zip(changed_files, descriptions):
+            file.metadata = metadata
+            file.error = error
+
+        mtime_is_racy = time.time() - folder_mtime / 1e9 < RACY_MTIME_SECONDS
+        write_index(FolderIndex(str(folder), None if mtime_is_racy else folder_mtime, files))
+
+        return files
@@ -0,0 +1,187 @@
+import os
+from collections import OrderedDict
+
+import aqt
+from aqt.qt import Qt, QImage, QImageReader, QPixmap, QSize
+
+from .profiling import profiler
+
+
+def get_pixmap_size_in_bytes(pixmap: QPixmap) -> int:
+    return pixmap.width() * pixmap.height() * pixmap.depth() // 8
+
+
+# A least recently used cache of decoded images, shared by all windows.
+# Keys are tuples of (path, mtime, scale), where scale is `None` for unscaled images,
+# and a tuple of (scaling, width, height, device pixel ratio) for scaled ones.
+# When the total size of pixmaps exceeds the limit, the least recently used ones
+# are evicted; the one that was just added is kept even if it is larger than the limit.
+class PixmapCache:
+    def __init__(self, size_limit_in_bytes: int):
+        self.size_limit_in_bytes = size_limit_in_bytes
+        self.size_in_bytes = 0
+        self.pixmaps: "OrderedDict[tuple, QPixmap]" = OrderedDict()
+
+    def get(self, key) -> "QPixmap | None":
+        pixmap = self.pixmaps.get(key)
+        if pixmap is not None:
+            self.pixmaps.move_to_end(key)
+        return pixmap
+
+    def put(self, key, pixmap: QPixmap):
+        if key in self.pixmaps:
+            self.size_in_bytes -= get_pixmap_size_in_bytes(self.pixmaps.pop(key))
+        self.pixmaps[key] = pixmap
+        self.size_in_bytes += get_pixmap_size_in_bytes(pixmap)
+        self.evict()
+
+    def set_size_limit(self, size_limit_in_bytes: int):
+        self.size_limit_in_bytes = size_limit_in_bytes
+        self.evict()
+
+    def evict(self):
+        while self.size_in_bytes > self.size_limit_in_bytes and len(self.pixmaps) > 1:
+            _, pixmap = self.pixmaps.popitem(last=False)
+            self.size_in_bytes -= get_pixmap_size_in_bytes(pixmap)
+
+
+pixmap_cache = PixmapCache(size_limit_in_bytes=256 * 1024 * 1024)
+
+
+# Scaling modes. Like in css, with `cover` the image is scaled to cover
+# the whole window, and with `contain` it is scaled to fit inside of it.
+NONE = "none"
+COVER = "cover"
+CONTAIN = "contain"
+
+scaling_to_aspect_ratio_mode = {
+    COVER: Qt.AspectRatioMode.KeepAspectRatioByExpanding,
+    CONTAIN: Qt.AspectRatioMode.KeepAspectRatio,
+}
+
+
+# The mtime is a part of the key, so that images that were edited are reloaded.
+# Raises `OSError` if the file can't be accessed.
+def get_cache_key(path: str, scale: "tuple | None" = None) -> tuple:
+    return path, os.stat(path).st_mtime_ns, scale
+
+
+# Width and height of the scale are in device pixels. The result has
+# the given device pixel ratio, so that on high dpi screens
+# it is painted without being scaled again. Works with both pixmaps and images.
+def scale_image(image, scale: tuple):
+    scaling, width, height, device_pixel_ratio = scale
+    result = image.scaled(
+        QSize(width, height),
+        scaling_to_aspect_ratio_mode[scaling],
+        Qt.TransformationMode.SmoothTransformation,
+    )
+    result.setDevicePixelRatio(device_pixel_ratio)
+    return result
+
+
+# Large images are only decoded at the size they will be shown at;
+# for jpeg files, this means that most of the image doesn't even have to be decoded.
+# The result may need to be scaled further, see `scale_image`.
+# Returns a null image if the file can't be read or decoded.
+def read_image(path: str, scale: "tuple | None" = None) -> QImage:
+    reader = QImageReader(path)
+    source_size = reader.size()
+
+    if scale is not None and source_size.isValid():
+        scaling, width, height, _device_pixel_ratio = scale
+        size = source_size.scaled(QSize(width, height), scaling_to_aspect_ratio_mode[scaling])
+        if size.width() < source_size.width():
+            reader.setScaledSize(size)
+
+    if not profiler.enabled:
+        return reader.read()
+
+    with profiler.measuring("decoding images" if scale is None
+                            else "decoding images, scaled while decoding"):
+        image = reader.read()
+
+    if source_size.isValid() and not image.isNull():
+        profiler.add_size("source images", source_size.width() * source_size.height() * 4)
+        profiler.add_size("decoded images", image.sizeInBytes())
+
+    return image
+
+
+# Returns a null pixmap if the file can't be read or decoded.
+def load_pixmap(path: str, scale: "tuple | None" = None) -> QPixmap:
+    try:
+        key = get_cache_key(path, scale)
+    except OSError:
+        return QPixmap()
+
+    if (pixmap := pixmap_cache.get(key)) is None:
+        image = read_image(path, scale)
+        if image.isNull():
+            return QPixmap()
+
+        if scale is not None:
+            image = scale_image(image, scale)
+        pixmap = QPixmap.fromImage(image)
+        pixmap_cache.put(key, pixmap)
+
+    return pixmap
+
+
+########################################################################################
+
+
+# Keys of images that are being decoded in the background, mapped to the tasks
+# that decode them. A task only decodes, and caches, the keys that are still its own.
+prefetching_keys: "dict[tuple, object]" = {}
+
+
+# Decodes the image at each of the given scales in the background,
+# so that a subsequent `load_pixmap` merely takes the pixmap from the cache.
+# Unlike pixmaps, images can be used outside of the main thread;
+# they are converted to pixmaps and put into the cache on the main thread.
+def prefetch_pixmaps(path: str, scales: "list[tuple | None]"):
+    try:
+        keys = [get_cache_key(path, scale) for scale in scales]
+    except OSError:
+        return
+
+    keys = [key for key in keys if key not in pixmap_cache.pixmaps
+                               and key not in prefetching_keys]
+    if not keys:
+        return
+
+    task = object()
+    for key in keys:
+        prefetching_keys[key] = task
+
+    def is_wanted(key):
+        return prefetching_keys.get(key) is task
+
+    def decode():
+        images = []
+        for key in keys:
+            if is_wanted(key):
+                scale = key[2]
+                image = read_image(path, scale)
+                if not image.isNull():
+                    images.append((key, image if scale is None else scale_image(image, scale)))
+        return images
+
+    def on_decoded(future):
+        for key, image in future.result():
+            if is_wanted(key):
+                pixmap_cache.put(key, QPixmap.fromImage(image))
+
+        for key in keys:
+            if is_wanted(key):
+                del prefetching_keys[key]
+
+    aqt.mw.taskman.run_in_background(decode, on_decoded)
+
+
+# Images of other paths that are not decoded yet won't be decoded.
+# An image that is being decoded can't be stopped, but it won't be cached.
+def cancel_prefetching_except(paths: "list[str]"):
+    for key in [key for key in prefetching_keys if key[0] not in paths]:
+        del prefetching_keys[key]
@@ -0,0 +1,141 @@
+from aqt.qt import Qt, QObject, QEvent, QPainter, QPoint, QRect, QSize, QStyle, QTimer, QWidget
+
+from .images import NONE, load_pixmap, scaling_to_aspect_ratio_mode
+from .profiling import profiler
+
+
+# While the window is being resized, the old pixmap is stretched,
+# and a new one is only made after the resizing stops for this long
+RESIZE_DEBOUNCE_MILLISECONDS = 150
+
+
+position_word_to_alignment = {
+    "center": Qt.AlignmentFlag.AlignCenter,
+    "left": Qt.AlignmentFlag.AlignLeft,
+    "right": Qt.AlignmentFlag.AlignRight,
+    "top": Qt.AlignmentFlag.AlignTop,
+    "bottom": Qt.AlignmentFlag.AlignBottom,
+}
+
+
+# This is how Qt parses `background-position` of style sheets
+def get_alignment(position: str):
+    alignment = Qt.AlignmentFlag(0)
+    for word in position.split():
+        alignment |= position_word_to_alignment[word]
+    return alignment
+
+
+def get_aligned_rect(position: str, size: QSize, rect: QRect) -> QRect:
+    return QStyle.alignedRect(Qt.LayoutDirection.LeftToRight, get_alignment(position), size, rect)
+
+
+def get_logical_size(pixmap) -> QSize:
+    ratio = pixmap.devicePixelRatio()
+    return QSize(round(pixmap.width() / ratio), round(pixmap.height() / ratio))
+
+
+# Paints the wallpaper of a widget before the widget paints itself.
+# This replaces `background-image` in the style sheet of the widget,
+# which makes Qt load the image anew whenever the style sheet is set.
+# The pixmaps come from the shared cache instead.
+#
+# Unless scaling is `none`, the pixmap is scaled for the exact current size
+# of the widget in device pixels, and is cached, as well as prefetched, at that size,
+# so that both switching wallpapers and painting are merely copying it.
+# When the widget is resized, a new pixmap is made after the resizing stops;
+# until then, the old one is stretched.
+#
+# Painting in an event filter is fine, since Qt is already
+# in the middle of painting the widget when the filter is called.
+class WallpaperPainter(QObject):
+    def __init__(self, widget: QWidget):
+        super().__init__(widget)
+        self.widget = widget
+        self.wallpaper = None
+        self.scaling = NONE
+        self.scale = None
+        self.pixmap = None
+
+        self.resize_timer = QTimer(self)
+        self.resize_timer.setSingleShot(True)
+        self.resize_timer.setInterval(RESIZE_DEBOUNCE_MILLISECONDS)
+        self.resize_timer.timeout.connect(self.update_pixmap)  # noqa
+
+        widget.installEventFilter(self)
+
+    def set_wallpaper(self, wallpaper, scaling: str = NONE):
+        if (wallpaper, scaling) != (self.wallpaper, self.scaling):
+            self.wallpaper = wallpaper
+            self.scaling = scaling
+            self.update_pixmap()
+
+    def update_pixmap(self):
+        if self.scaling == NONE:
+            self.scale = None
+        else:
+            device_pixel_ratio = self.widget.devicePixelRatioF()
+            size = self.widget.size() * device_pixel_ratio
+            self.scale = self.scaling, size.width(), size.height(), device_pixel_ratio
+
+        if self.wallpaper is None:
+            self.pixmap = None
+        else:
+            self.pixmap = load_pixmap(self.wallpaper.url, self.scale)
+
+        self.widget.update()
+
+    def eventFilter(self, obj, event):  # noqa
+        if event.type() == QEvent.Type.Resize and self.scaling != NONE and self.pixmap:
+            self.resize_timer.start()
+
+        elif event.type() == QEvent.Type.Paint and self.pixmap and not self.pixmap.isNull():
+            with profiler.measuring("WallpaperPainter painting"):
+                painter = QPainter(self.widget)
+                if self.scaling == NONE:
+                    self.paint_tiled(painter)
+                else:
+                    self.paint_scaled(painter)
+                painter.end()
+
+        return False
+
+    # Like style sheets, which repeat the background image by default,
+    # tile the pixmap, starting from where it would be aligned.
+    def paint_tiled(self, painter: QPainter):
+        rect = self.widget.rect()
+        aligned_rect = get_aligned_rect(self.wallpaper.position, self.pixmap.size(), rect)
+        offset = QPoint(
+            (rect.x() - aligned_rect.x()) % self.pixmap.width(),
+            (rect.y() - aligned_rect.y()) % self.pixmap.height(),
+        )
+        painter.drawTiledPixmap(rect, self.pixmap, offset)
+
+    def paint_scaled(self, painter: QPainter):
+        rect = self.widget.rect()
+        size = get_logical_size(self.pixmap)
+
+        if self.resize_timer.isActive():
+            size = size.scaled(rect.size(), scaling_to_aspect_ratio_mode[self.scaling])
+
+        painter.drawPixmap(get_aligned_rect(self.wallpaper.position, size, rect), self.pixmap)
+
+
+def set_widget_wallpaper(widget: QWidget, wallpaper, scaling: str = NONE):
+    try:
+        painter = widget._wallpaper_painter
+    except AttributeError:
+        painter = widget._wallpaper_painter = WallpaperPainter(widget)
+    painter.set_wallpaper(wallpaper, scaling)
+
+
+def unset_widget_wallpaper(widget: QWidget):
+    if painter := getattr(widget, "_wallpaper_painter", None):
+        painter.set_wallpaper(None)
+
+
+# Returns the scales that pixmaps must have to be painted on the given widgets
+def get_widget_scales(widgets: "list[QWidget]") -> "set[tuple | None]":
+    return {painter.scale for widget in widgets
+            if (painter := getattr(widget, "_wallpaper_painter", None))
+            and painter.wallpaper is not None}
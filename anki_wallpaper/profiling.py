@@ -0,0 +1,127 @@
+import time
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass
+from functools import wraps
+from pathlib import Path
+
+
+TIMINGS_FILE_PATH = Path(__file__).parent / "user_files" / "timings.txt"
+
+
+@dataclass
+class Timing:
+    calls: int = 0
+    total_seconds: float = 0
+    max_seconds: float = 0
+
+    def add(self, seconds: float):
+        self.calls += 1
+        self.total_seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+
+
+@dataclass
+class Size:
+    count: int = 0
+    total_bytes: int = 0
+    max_bytes: int = 0
+
+    def add(self, size_in_bytes: int):
+        self.count += 1
+        self.total_bytes += size_in_bytes
+        self.max_bytes = max(self.max_bytes, size_in_bytes)
+
+
+# Collects the number of calls, and the total and the maximum durations,
+# of the code that the add-on runs on Anki's hot paths: patched methods, hooks,
+# painting, setting style sheets, decoding images; as well as sizes
+# of decoded images. Disabled unless `collect_timings` is set,
+# in which case the timings are written to `user_files/timings.txt`
+# when the profile is closed. When disabled, measuring costs a single check.
+class Profiler:
+    def __init__(self):
+        self.enabled = False
+        self.timings: "dict[str, Timing]" = {}
+        self.sizes: "dict[str, Size]" = {}
+
+    def add(self, name: str, seconds: float):
+        try:
+            self.timings[name].add(seconds)
+        except KeyError:
+            timing = self.timings[name] = Timing()
+            timing.add(seconds)
+
+    def add_size(self, name: str, size_in_bytes: int):
+        try:
+            self.sizes[name].add(size_in_bytes)
+        except KeyError:
+            size = self.sizes[name] = Size()
+            size.add(size_in_bytes)
+
+    def measuring(self, name: str):
+        return self.measuring_always(name) if self.enabled else nullcontext()
+
+    # Used for things that happen before the config is loaded, such as startup
+    @contextmanager
+    def measuring_always(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def get_report(self) -> str:
+        def ms(seconds):
+            return f"{seconds * 1000:10.2f}"
+
+        lines = [f"{'':50} {'calls':>8} {'total, ms':>10} {'max, ms':>10}"]
+        for name, timing in sorted(self.timings.items(),
+                                   key=lambda item: item[1].total_seconds, reverse=True):
+            lines.append(f"{name:50} {timing.calls:8} "
+                         f"{ms(timing.total_seconds)} {ms(timing.max_seconds)}")
+
+        def mb(size_in_bytes):
+            return f"{size_in_bytes / 1024 / 1024:10.1f}"
+
+        if self.sizes:
+            lines.append("")
+            lines.append(f"{'':50} {'count':>8} {'total, MB':>10} {'max, MB':>10}")
+            for name, size in self.sizes.items():
+                lines.append(f"{name:50} {size.count:8} "
+                             f"{mb(size.total_bytes)} {mb(size.max_bytes)}")
+
+        return "\n".join(lines)
+
+    # Without a path, the report is printed, e.g. to Anki's debug console
+    def dump(self, path: "Path | None" = TIMINGS_FILE_PATH):
+        if not self.timings and not self.sizes:
+            return
+
+        if path is None:
+            print(self.get_report())
+        else:
+            try:
+                path.parent.mkdir(exist_ok=True)
+                path.write_text(self.get_report() + "\n", encoding="utf-8")
+            except OSError:
+                pass
+
+
+profiler = Profiler()
+
+
+# Measures the function under the given name, or under its qualified name
+def timed(name: "str | None" = None):
+    def decorator(function):
+        measured_name = name or function.__qualname__
+
+        @wraps(function)
+        def timed_function(*args, **kwargs):
+            if not profiler.enabled:
+                return function(*args, **kwargs)
+            with profiler.measuring(measured_name):
+                return function(*args, **kwargs)
+
+        return timed_function
+
+    return decorator
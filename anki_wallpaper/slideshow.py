@@ -0,0 +1,85 @@
+from typing import Callable
+
+from aqt.qt import QApplication, QObject, QTimer, Qt, QWidget, sip
+
+
+# The next wallpaper is prefetched this long before it is shown
+PREFETCH_LEAD_MILLISECONDS = 10 * 1000
+
+
+# Switches wallpapers every so often, unless the interval is 0.
+# A single timer is used; it first times out a bit before the switch is due,
+# to prefetch the next wallpaper, and then again when the switch is due.
+# While the window is hidden or minimized, or the application is inactive,
+# the timer is stopped, and the remaining time is kept until it is seen again.
+class Slideshow(QObject):
+    def __init__(self, window: QWidget, prefetch: Callable[[], None],
+                 switch: Callable[[], None]):
+        super().__init__(window)
+        self.window = window
+        self.prefetch = prefetch
+        self.switch = switch
+        self.interval_milliseconds = 0
+        self.remaining_milliseconds = 0
+        self.prefetched = False
+
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.on_timeout)  # noqa
+
+        window.winId()  # makes sure that the window has a handle
+        window.windowHandle().visibilityChanged.connect(self.update)  # noqa
+        QApplication.instance().applicationStateChanged.connect(self.update)  # noqa
+
+    def set_interval(self, minutes: float):
+        interval_milliseconds = int(minutes * 60 * 1000)
+        if interval_milliseconds != self.interval_milliseconds:
+            self.interval_milliseconds = interval_milliseconds
+            self.restart()
+
+    # Called when the wallpaper was switched, so that it is shown for the whole interval
+    def restart(self):
+        self.timer.stop()
+        self.remaining_milliseconds = self.interval_milliseconds
+        self.prefetched = False
+        self.update()
+
+    def is_seen(self) -> bool:
+        return self.window.isVisible() and not self.window.isMinimized() \
+            and QApplication.applicationState() == Qt.ApplicationState.ApplicationActive
+
+    # Signals can still come while the window is being destroyed, e.g. on exit
+    def update(self, *_args):
+        if sip.isdeleted(self.window):
+            return
+
+        if self.interval_milliseconds and self.is_seen():
+            if not self.timer.isActive():
+                self.start_timer()
+        elif self.timer.isActive():
+            self.remaining_milliseconds = self.get_remaining_milliseconds()
+            self.timer.stop()
+
+    def get_remaining_milliseconds(self) -> int:
+        lead = 0 if self.prefetched else PREFETCH_LEAD_MILLISECONDS
+        return max(self.timer.remainingTime(), 0) + lead
+
+    def start_timer(self):
+        if self.prefetched:
+            self.timer.start(self.remaining_milliseconds)
+        elif self.remaining_milliseconds > PREFETCH_LEAD_MILLISECONDS:
+            self.timer.start(self.remaining_milliseconds - PREFETCH_LEAD_MILLISECONDS)
+        else:
+            self.prefetched = True
+            self.prefetch()
+            self.timer.start(self.remaining_milliseconds)
+
+    def on_timeout(self):
+        if self.prefetched:
+            self.switch()
+            self.restart()
+        else:
+            self.prefetched = True
+            self.prefetch()
+            self.remaining_milliseconds = PREFETCH_LEAD_MILLISECONDS
+            self.timer.start(self.remaining_milliseconds)
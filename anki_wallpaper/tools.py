@@ -1,28 +1,32 @@
 from functools import wraps, partial
 
-import aqt
+from .profiling import profiler, timed
 
 
+# Only the time spent in `function` is measured, which for `replace`
+# includes the time spent in the original method, if `function` calls it.
 def patch_method(obj, method_name, action):
     original_method = getattr(obj, method_name)
 
     def decorator(function):
+        timed_function = timed(f"{obj.__name__}.{method_name} ({action})")(function)
+
         if action == "replace":
             @wraps(original_method)
             def patched_method(*args, **kwargs):
-                return function(*args, **kwargs)
+                return timed_function(*args, **kwargs)
 
         elif action == "prepend":
             @wraps(original_method)
             def patched_method(*args, **kwargs):
-                function(*args, **kwargs)
+                timed_function(*args, **kwargs)
                 return original_method(*args, **kwargs)
 
         elif action == "append":
             @wraps(original_method)
             def patched_method(*args, **kwargs):
                 result = original_method(*args, **kwargs)
-                function(*args, **kwargs)
+                timed_function(*args, **kwargs)
                 return result
 
         else:
@@ -39,8 +43,8 @@ append_to_method = partial(patch_method, action="append")
 replace_method = partial(patch_method, action="replace")
 
 
-def get_dialog_instance_or_none(name):
-    try:
-        return aqt.dialogs._dialogs[name][1]
-    except KeyError:
-        return None
+# The widget remembers the style sheet that was last set, so this is only a comparison
+def set_style_sheet(widget, style_sheet):
+    if widget.styleSheet() != style_sheet:
+        with profiler.measuring(f"{widget.__class__.__name__}.setStyleSheet"):
+            widget.setStyleSheet(style_sheet)
@@ -0,0 +1,113 @@
+import hashlib
+import os
+import threading
+from dataclasses import replace
+from pathlib import Path
+
+from aqt.qt import Qt, QGuiApplication, QImageReader, QSize
+
+
+# Downscaled copies of wallpapers that are larger than any of the screens.
+# These are only made for the current wallpaper folder;
+# variants that are no longer used are deleted.
+VARIANTS_FOLDER = Path(__file__).parent / "user_files" / "variants"
+
+
+# In device pixels. Must be called on the main thread.
+def get_largest_screen_size() -> QSize:
+    width = height = 0
+
+    for screen in QGuiApplication.screens():
+        size = screen.size() * screen.devicePixelRatio()
+        width = max(width, size.width())
+        height = max(height, size.height())
+
+    return QSize(width, height)
+
+
+# The name of the variant is derived from the path, size and mtime of the source,
+# as well as of the target size, so a new variant is made whenever any of them change.
+def get_variant_path(source_path: Path, max_size: QSize) -> Path:
+    stat = source_path.stat()
+    key = f"{source_path}\0{stat.st_size}\0{stat.st_mtime_ns}\0{max_size.width()}x{max_size.height()}"
+    suffix = ".jpg" if source_path.suffix.lower() in [".jpg", ".jpeg"] else ".png"
+    return VARIANTS_FOLDER / (hashlib.sha1(key.encode()).hexdigest() + suffix)
+
+
+# The size of the variant, or `None` if the source is small enough as it is
+def get_variant_size(source_size: QSize, max_size: QSize) -> "QSize | None":
+    size = source_size.scaled(max_size, Qt.AspectRatioMode.KeepAspectRatioByExpanding)
+    return size if size.width() < source_size.width() else None
+
+
+# Returns `True` if the variant was made, `False` if the source doesn't need it.
+# The image is scaled while it is being decoded, which for jpeg files
+# means that the full size image doesn't even have to be decoded.
+def make_variant(source_path: Path, variant_path: Path, max_size: QSize) -> bool:
+    reader = QImageReader(str(source_path))
+    source_size = reader.size()
+
+    if not source_size.isValid():
+        return False
+
+    size = get_variant_size(source_size, max_size)
+    if size is None:
+        return False
+
+    reader.setScaledSize(size)
+    image = reader.read()
+    if image.isNull():
+        return False
+
+    VARIANTS_FOLDER.mkdir(parents=True, exist_ok=True)
+    temporary_path = variant_path.with_suffix(".tmp" + variant_path.suffix)
+    if not image.save(str(temporary_path), None, 90):
+        return False
+    os.replace(temporary_path, variant_path)
+    return True
+
+
+lock = threading.Lock()
+
+
+# This takes a while, so it should be run in the background.
+# Returns the wallpapers with the urls of the ones that are too large replaced.
+# Wallpapers whose size is known from the folder index, and that are small enough,
+# are skipped without touching their files.
+# Unless `make_missing` is set, only the variants that already exist are used;
+# this merely takes a `stat` of each large wallpaper, and the variants are kept.
+# Otherwise, the missing variants are made, and the ones not used are deleted.
+def get_wallpapers_with_downscaled_variants(wallpapers: list, max_size: QSize,
+                                            make_missing: bool = True) -> list:
+    with lock:
+        result = []
+        used_variant_paths = set()
+
+        for wallpaper in wallpapers:
+            source_url = wallpaper.source_url or wallpaper.url
+            source_path = Path(source_url)
+            source_size = QSize(wallpaper.width, wallpaper.height)
+            wallpaper = replace(wallpaper, url=source_url, source_url=None)
+
+            if source_size.isEmpty() or get_variant_size(source_size, max_size) is not None:
+                try:
+                    variant_path = get_variant_path(source_path, max_size)
+                    if variant_path.exists() or \
+                            make_missing and make_variant(source_path, variant_path, max_size):
+                        used_variant_paths.add(variant_path)
+                        wallpaper = replace(wallpaper, url=variant_path.as_posix(),
+                                            source_url=source_url)
+                except OSError:
+                    pass
+
+            result.append(wallpaper)
+
+        if make_missing and VARIANTS_FOLDER.exists():
+            for path in VARIANTS_FOLDER.iterdir():
+                if path not in used_variant_paths:
+                    try:
+                        path.unlink()
+                    except OSError:
+                        pass
+
+        return result
@@ -0,0 +1,28 @@
+from pathlib import Path
+
+from aqt.qt import QObject, QFileSystemWatcher, QTimer
+
+
+# Copying a bunch of files into the folder produces a burst of change signals;
+# the callback is called once the folder stopped changing for this long
+FOLDER_CHANGES_DEBOUNCE_MILLISECONDS = 500
+
+
+class FolderWatcher(QObject):
+    def __init__(self, parent: QObject, on_folder_changed):
+        super().__init__(parent)
+
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(FOLDER_CHANGES_DEBOUNCE_MILLISECONDS)
+        self.timer.timeout.connect(on_folder_changed)  # noqa
+
+        self.watcher = QFileSystemWatcher(self)
+        self.watcher.directoryChanged.connect(self.timer.start)  # noqa
+
+    def watch(self, folder: str):
+        if self.watcher.directories() != [folder]:
+            if directories := self.watcher.directories():
+                self.watcher.removePaths(directories)
+            if Path(folder).is_dir():
+                self.watcher.addPath(folder)
@@ -0,0 +1,49 @@
+import weakref
+
+from aqt.qt import QWidget, sip
+
+
+# Kinds of wallpapered widgets
+MAIN_WINDOW = "main_window"
+DIALOG = "dialog"
+PREVIEWER = "previewer"
+
+
+# Widgets that the add-on has styled, along with their kinds, so that all of them
+# can be updated at once, e.g. when the wallpaper or the theme changes.
+# Widgets are held by weak references, and are removed when they are destroyed.
+# Python wrappers of Qt widgets can outlive the widgets themselves, in which case
+# the `destroyed` signal removes them; the reverse is handled by the weak references.
+class WidgetRegistry:
+    def __init__(self):
+        self.widgets: "dict[int, tuple[weakref.ref, str]]" = {}
+
+    def add(self, widget: QWidget, kind: str):
+        key = id(widget)
+
+        entry = self.widgets.get(key)
+        if entry is not None and entry[0]() is widget:
+            return
+
+        reference = weakref.ref(widget)
+        self.widgets[key] = reference, kind
+        widget.destroyed.connect(lambda *_: self.remove(key, reference))  # noqa
+
+    def remove(self, key: int, reference: weakref.ref):
+        entry = self.widgets.get(key)
+        if entry is not None and entry[0] is reference:
+            del self.widgets[key]
+
+    def get_widgets(self) -> "list[tuple[QWidget, str]]":
+        widgets = []
+
+        for key, (reference, kind) in list(self.widgets.items()):
+            if (widget := reference()) is not None and not sip.isdeleted(widget):
+                widgets.append((widget, kind))
+            else:
+                del self.widgets[key]
+
+        return widgets
+
+
+wallpapered_widgets = WidgetRegistry()
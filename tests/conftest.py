@@ -30,6 +30,18 @@ from tests.tools.testing import (
     session_with_profile_loaded,
 )
 
+# noinspection PyUnresolvedReferences
+from tests.tools.benchmarking import (
+    pytest_configure,
+    pytest_collection_modifyitems,
+    pytest_runtest_logreport,
+    pytest_sessionfinish,
+    pytest_terminal_summary,
+    benchmark_baseline,
+    benchmarks,
+    synthetic_wallpaper_folders,
+)
+
 
 addon_name = "anki_wallpaper"
 addon_folder = os.path.join(os.path.split(__file__)[0], f"../{addon_name}")
@@ -0,0 +1,96 @@
+import aqt
+import pytest
+
+from tests.tools.collection import anki_version
+
+
+pytestmark = pytest.mark.benchmark
+
+WALLPAPER_COUNTS = [10, 1_000, 10_000]
+RESOLUTIONS = [(1280, 720), (1920, 1080), (3840, 2160)]
+
+counts = pytest.mark.parametrize("count", WALLPAPER_COUNTS)
+resolutions = pytest.mark.parametrize("resolution", RESOLUTIONS,
+                                      ids=[f"{w}x{h}" for w, h in RESOLUTIONS])
+
+
+# As background tasks are run on the main thread in tests,
+# the times include loading wallpaper folders, as well as prefetching
+# and decoding wallpapers, which normally happen in the background.
+# Windows are repainted right away, so painting is included as well.
+def use_wallpaper_folder(setup, folder):
+    anki_wallpaper = setup.anki_wallpaper
+    config = aqt.mw.addonManager.getConfig("anki_wallpaper")
+    config["folder_with_wallpapers"] = str(folder)
+    aqt.mw.addonManager.writeConfig("anki_wallpaper", config)
+    anki_wallpaper.config.load(on_done=anki_wallpaper.on_config_loaded)
+    assert not anki_wallpaper.config.wallpapers.errors
+
+
+def repaint_main_window():
+    aqt.mw.repaint()
+
+
+@counts
+@resolutions
+def test_next_wallpaper(setup, benchmarks, synthetic_wallpaper_folders, count, resolution):
+    use_wallpaper_folder(setup, synthetic_wallpaper_folders(count, *resolution))
+
+    def next_wallpaper():
+        setup.anki_wallpaper.next_wallpaper()
+        repaint_main_window()
+
+    benchmarks.measure(f"next_wallpaper[{count}-{resolution[0]}x{resolution[1]}]",
+                       next_wallpaper)
+
+
+@counts
+@resolutions
+def test_set_wallpapers_now(setup, benchmarks, synthetic_wallpaper_folders, count, resolution):
+    use_wallpaper_folder(setup, synthetic_wallpaper_folders(count, *resolution))
+
+    def set_wallpapers_now():
+        setup.anki_wallpaper.set_wallpapers_now()
+        repaint_main_window()
+
+    benchmarks.measure(f"set_wallpapers_now[{count}-{resolution[0]}x{resolution[1]}]",
+                       set_wallpapers_now)
+
+
+@pytest.mark.skipif(anki_version < (2, 1, 50), reason="not applicable to Anki < 2.1.50")
+@counts
+@resolutions
+def test_theme_change(setup, benchmarks, synthetic_wallpaper_folders, count, resolution):
+    from aqt.theme import Theme
+
+    use_wallpaper_folder(setup, synthetic_wallpaper_folders(count, *resolution))
+    themes = [Theme.DARK, Theme.LIGHT]
+
+    def change_theme():
+        themes.reverse()
+        aqt.mw.set_theme(themes[0])
+        repaint_main_window()
+
+    try:
+        benchmarks.measure(f"theme_change[{count}-{resolution[0]}x{resolution[1]}]",
+                           change_theme)
+    finally:
+        aqt.mw.set_theme(Theme.LIGHT)
+
+
+# The resolution doesn't matter here, as only image headers are read
+@counts
+@pytest.mark.parametrize("index", ["warm", "cold"])
+def test_config_load(setup, benchmarks, synthetic_wallpaper_folders, count, index):
+    folder_index = setup.anki_wallpaper.folder_index
+
+    use_wallpaper_folder(setup, synthetic_wallpaper_folders(count, 1920, 1080))
+
+    def drop_folder_index():
+        folder_index.index_in_memory = None
+        folder_index.INDEX_FILE_PATH.unlink(missing_ok=True)
+
+    benchmarks.measure(f"config_load[{count}-{index}]",
+                       setup.anki_wallpaper.config.load,
+                       rounds=20 if index == "warm" or count < 10_000 else 5,
+                       before_each=drop_folder_index if index == "cold" else None)
@@ -0,0 +1,468 @@
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import Future
+from dataclasses import asdict, replace
+from pathlib import Path
+
+import pytest
+
+from tests.tools.headless import import_addon_module_without_anki
+
+
+# These tests don't need Anki running, and take milliseconds.
+# Run just them with `pytest tests/test_configuration.py -n 0`.
+
+
+class FakeTimer:
+    def __init__(self, _interval, callback):
+        self.callback = callback
+        self.active = False
+
+    def start(self):
+        self.active = True
+
+    def stop(self):
+        self.active = False
+
+    def fire(self):
+        self.active = False
+        self.callback()
+
+
+class FakeAnki:
+    def __init__(self, configuration, data):
+        self.configuration = configuration
+        self.data = data
+        self.dark_mode = False
+        self.warnings = []
+        self.timers = []
+        self.variant_urls = {}
+        self.deferred_tasks: "list | None" = None
+
+    def read_config(self):
+        return {**self.data}
+
+    def write_config(self, data):
+        self.data = {**data}
+
+    def make_timer(self, interval, callback):
+        timer = FakeTimer(interval, callback)
+        self.timers.append(timer)
+        return timer
+
+    # Background tasks are run right away, unless they are deferred,
+    # in which case they are run by `finish_task()` in any order
+    def run_in_background(self, task, on_done):
+        if self.deferred_tasks is None:
+            self.finish(task, on_done)
+        else:
+            self.deferred_tasks.append((task, on_done))
+
+    def finish_task(self, index):
+        self.finish(*self.deferred_tasks.pop(index))
+
+    @staticmethod
+    def finish(task, on_done):
+        future = Future()
+        future.set_result(task())
+        on_done(future)
+
+    # Variants are looked up by the urls of the originals
+    def make_variant_finder(self):
+        def find_variants(wallpapers):
+            return [replace(wallpaper, url=self.variant_urls[wallpaper.url],
+                            source_url=wallpaper.url)
+                    if wallpaper.url in self.variant_urls else wallpaper
+                    for wallpaper in wallpapers]
+        return find_variants
+
+    def describe_files(self, files):
+        return [(asdict(self.configuration.Wallpaper.from_file_path(file)), None)
+                if file.suffix == ".png" else (None, None) for file in files]
+
+    def get_environment(self):
+        return self.configuration.Environment(
+            read_config=self.read_config,
+            write_config=self.write_config,
+            is_dark_mode=lambda: self.dark_mode,
+            show_warning=self.warnings.append,
+            describe_files=self.describe_files,
+            run_in_background=self.run_in_background,
+            make_timer=self.make_timer,
+            make_variant_finder=self.make_variant_finder,
+        )
+
+
+@pytest.fixture
+def configuration(tmp_path, monkeypatch):
+    folder_index = import_addon_module_without_anki("folder_index")
+    monkeypatch.setattr(folder_index, "INDEX_FILE_PATH", tmp_path / "folder_index.json")
+    monkeypatch.setattr(folder_index, "index_in_memory", None)
+
+    return import_addon_module_without_anki("configuration")
+
+
+def make_wallpaper_folder(folder: Path, *file_names):
+    folder.mkdir(exist_ok=True)
+    for file_name in file_names:
+        (folder / file_name).write_bytes(b"")
+    return folder
+
+
+@pytest.fixture
+def anki(configuration, tmp_path):
+    folder = make_wallpaper_folder(tmp_path / "wallpapers",
+                                   "a.png", "b.png", "a.dark.png", "b.dark.png")
+    data = {
+        "folder_with_wallpapers": str(folder),
+        "enabled_for": ["main_window", "add_cards", "previewer"],
+        "light_wallpaper_index": 0,
+        "dark_wallpaper_index": 0,
+        "image_cache_size_in_megabytes": 256,
+        "scaling": "none",
+        "downscale_large_wallpapers": False,
+        "slideshow_interval_minutes": 0,
+        "collect_timings": False,
+    }
+    return FakeAnki(configuration, data)
+
+
+########################################################################################
+
+
+def test_configuration_can_be_imported_without_anki():
+    code = "import sys; sys.modules['aqt'] = None; " \
+           "from tests.tools.headless import import_addon_module_without_anki; " \
+           "import_addon_module_without_anki('configuration')"
+    subprocess.run([sys.executable, "-c", code], check=True,
+                   cwd=Path(__file__).parent.parent)
+
+
+def test_wallpaper_from_file_path(configuration):
+    Wallpaper = configuration.Wallpaper  # noqa
+
+    wallpaper = Wallpaper.from_file_path(Path("/wallpapers/forest.dark.left-top.png"))
+    assert wallpaper.url == "/wallpapers/forest.dark.left-top.png"
+    assert wallpaper.dark
+    assert set(wallpaper.position.split()) == {"left", "top"}
+
+    wallpaper = Wallpaper.from_file_path(Path("/wallpapers/darkness.png"))
+    assert not wallpaper.dark
+    assert wallpaper.position == "center"
+
+
+def test_is_enabled_from_data(configuration):
+    is_enabled = configuration.IsEnabled.from_data({"enabled_for": ["main_window", "edit"]})
+    assert is_enabled.for_main_window
+    assert not is_enabled.for_previewer
+    assert is_enabled.for_dialog("Edit")
+    assert not is_enabled.for_dialog("AddCards")
+
+
+def test_wallpapers_from_data(configuration, anki, tmp_path):
+    make_wallpaper_folder(tmp_path / "wallpapers", "Thumbs.db")
+    wallpapers = configuration.Wallpapers.from_data(anki.data, anki.describe_files)
+
+    assert [Path(wallpaper.url).name for wallpaper in wallpapers.light] == ["a.png", "b.png"]
+    assert [Path(wallpaper.url).name for wallpaper in wallpapers.dark] == ["a.dark.png", "b.dark.png"]
+    assert wallpapers.errors == []
+
+
+def test_wallpapers_from_data_reports_missing_dark_wallpapers(configuration, anki, tmp_path):
+    anki.data["folder_with_wallpapers"] = str(make_wallpaper_folder(tmp_path / "light", "a.png"))
+    wallpapers = configuration.Wallpapers.from_data(anki.data, anki.describe_files)
+
+    assert len(wallpapers.light) == 1
+    assert wallpapers.errors == [f"Folder does not contain dark wallpapers: '{tmp_path / 'light'}'"]
+
+
+def test_config_load_shows_warning_on_errors(configuration, anki, tmp_path):
+    anki.data["folder_with_wallpapers"] = str(tmp_path / "owo whats this")
+    configuration.Config(anki.get_environment()).load()
+
+    assert len(anki.warnings) == 1
+    assert "Error opening wallpaper folder" in anki.warnings[0]
+
+
+# Wallpapers are painted from pixmaps, and their paths never go into style sheets
+def test_wallpapers_can_have_quotes_in_their_paths(configuration, anki, tmp_path):
+    make_wallpaper_folder(tmp_path / "wallpapers", 'say "cheese".png')
+    config = configuration.Config(anki.get_environment())
+    config.load()
+
+    assert anki.warnings == []
+    assert config.wallpapers.light[-1].url.endswith('/say "cheese".png')
+
+
+def test_config_load_uses_sample_folder_by_default(configuration, anki):
+    anki.data["folder_with_wallpapers"] = "change_me"
+    config = configuration.Config(anki.get_environment())
+    config.load()
+
+    assert Path(anki.data["folder_with_wallpapers"]).name == "sample_wallpapers"
+    assert len(config.wallpapers.light) == 2
+    assert anki.warnings == []
+
+
+def test_current_wallpaper_follows_theme(configuration, anki):
+    config = configuration.Config(anki.get_environment())
+    config.load()
+
+    assert config.current_wallpaper.url.endswith("/a.png")
+    anki.dark_mode = True
+    assert config.current_wallpaper.url.endswith("/a.dark.png")
+
+
+def test_existing_variants_are_used_when_wallpapers_are_loaded(configuration, anki, tmp_path):
+    original_url = (tmp_path / "wallpapers" / "a.png").as_posix()
+    anki.variant_urls[original_url] = "/variants/a.png"
+    anki.data["downscale_large_wallpapers"] = True
+    config = configuration.Config(anki.get_environment())
+
+    current_wallpapers = []
+    config.load(on_done=lambda: current_wallpapers.append(config.current_wallpaper))
+
+    [wallpaper] = current_wallpapers
+    assert wallpaper.url == "/variants/a.png"
+    assert wallpaper.source_url == original_url
+    assert config.wallpapers.light[1].source_url is None
+
+
+def test_next_wallpaper_wraps_around_and_is_saved_lazily(configuration, anki):
+    config = configuration.Config(anki.get_environment())
+    config.load()
+
+    config.next_wallpaper()
+    assert config.current_wallpaper.url.endswith("/b.png")
+
+    assert anki.data["light_wallpaper_index"] == 0
+    [timer] = anki.timers
+    assert timer.active
+
+    timer.fire()
+    assert anki.data["light_wallpaper_index"] == 1
+
+    config.next_wallpaper()
+    assert config.current_wallpaper.url.endswith("/a.png")
+    assert config.indexes.light == 0
+
+
+def test_indexes_from_config_are_normalized(configuration, anki):
+    anki.data["light_wallpaper_index"] = 5
+    config = configuration.Config(anki.get_environment())
+    config.load()
+
+    assert config.indexes.light == 1
+    assert config.current_wallpaper.url.endswith("/b.png")
+
+
+def test_light_and_dark_wallpapers_are_paired_by_name(configuration, anki, tmp_path):
+    make_wallpaper_folder(tmp_path / "wallpapers", "c.png", "sky-top.png", "sky_dark-top.png")
+    wallpapers = configuration.Wallpapers.from_data(anki.data, anki.describe_files)
+
+    def names(wallpapers_):
+        return [Path(wallpaper.url).name for wallpaper in wallpapers_]
+
+    assert names(wallpapers.light) == ["a.png", "b.png", "c.png", "sky-top.png"]
+    assert names(wallpapers.dark) == ["a.dark.png", "b.dark.png", "sky_dark-top.png"]
+    assert wallpapers.light_to_dark == {0: 0, 1: 1, 3: 2}
+    assert wallpapers.dark_to_light == {0: 0, 1: 1, 2: 3}
+
+
+def test_theme_change_switches_to_paired_wallpaper(configuration, anki):
+    config = configuration.Config(anki.get_environment())
+    config.load()
+    config.next_wallpaper()
+
+    assert config.get_paired_wallpaper().url.endswith("/b.dark.png")
+
+    anki.dark_mode = True
+    config.switch_to_paired_wallpaper()
+    assert config.current_wallpaper.url.endswith("/b.dark.png")
+
+
+def test_reload_keeps_current_wallpaper(configuration, anki, tmp_path):
+    config = configuration.Config(anki.get_environment())
+    config.load()
+    config.next_wallpaper()
+    assert config.current_wallpaper.url.endswith("/b.png")
+
+    make_wallpaper_folder(tmp_path / "wallpapers", "0.png")
+    config.reload_wallpapers()
+
+    assert len(config.wallpapers.light) == 3
+    assert config.current_wallpaper.url.endswith("/b.png")
+
+
+def test_config_changes_are_applied_without_rescanning_the_folder(configuration, anki):
+    config = configuration.Config(anki.get_environment())
+    config.load()
+    wallpapers = config.wallpapers
+
+    anki.data["enabled_for"] = ["main_window", "edit"]
+    anki.data["light_wallpaper_index"] = 1
+    changes = []
+    config.load_changes(on_done=changes.append)
+
+    [change] = changes
+    assert change.enabled_for_tags == {"add_cards", "previewer", "edit"}
+    assert change.indexes_changed
+    assert config.wallpapers is wallpapers
+    assert config.is_enabled.for_dialog_class_names == ["Edit"]
+    assert config.current_wallpaper.url.endswith("/b.png")
+
+
+def test_changing_wallpaper_folder_rescans_it(configuration, anki, tmp_path):
+    config = configuration.Config(anki.get_environment())
+    config.load()
+
+    anki.data["folder_with_wallpapers"] = str(
+        make_wallpaper_folder(tmp_path / "other", "c.png", "c.dark.png"))
+    changes = []
+    config.load_changes(on_done=changes.append)
+
+    assert changes == [None]
+    assert config.current_wallpaper.url.endswith("/c.png")
+
+
+def test_rapid_wallpaper_switches_are_added_up(configuration, anki, tmp_path):
+    make_wallpaper_folder(tmp_path / "wallpapers", "c.png")
+    config = configuration.Config(anki.get_environment())
+    config.load()
+    switches = []
+
+    def on_switched():
+        switches.append(config.current_wallpaper.url)
+
+    switcher = configuration.WallpaperSwitcher(config, on_switched=on_switched)
+
+    for offset in [1, 1, 1, -1]:
+        switcher.switch(offset)
+    assert switches == []
+    assert config.indexes.light == 0
+
+    [switch_timer] = anki.timers
+    switch_timer.fire()
+    assert len(switches) == 1
+    assert switches[0].endswith("/c.png")
+
+    switcher.switch(3)
+    switch_timer.fire()
+    assert len(switches) == 1
+
+
+########################################################################################
+
+
+class DescribedFiles:
+    def __init__(self):
+        self.names = []
+
+    def __call__(self, files):
+        self.names.extend(file.name for file in files)
+        return [({"name": file.name}, None) for file in files]
+
+
+def backdate(path: Path, seconds=3600):
+    timestamp = time.time() - seconds
+    os.utime(path, (timestamp, timestamp))
+
+
+def test_folder_index_only_describes_changed_files(configuration, tmp_path):
+    folder_index = import_addon_module_without_anki("folder_index")
+    folder = make_wallpaper_folder(tmp_path / "wallpapers", "a.png", "b.png")
+    backdate(folder)
+
+    described_files = DescribedFiles()
+    folder_index.get_indexed_files(folder, described_files)
+    assert described_files.names == ["a.png", "b.png"]
+    assert folder_index.read_index().mtime == folder.stat().st_mtime_ns  # not listed again
+
+    described_files.names.clear()
+    files = folder_index.get_indexed_files(folder, described_files)
+    assert described_files.names == []
+    assert [file.name for file in files] == ["a.png", "b.png"]
+
+    (folder / "b.png").write_bytes(b"changed")
+    make_wallpaper_folder(folder, "c.png")
+    folder_index.get_indexed_files(folder, described_files)
+    assert described_files.names == ["b.png", "c.png"]
+
+
+def test_folder_index_doesnt_trust_recent_folder_mtime(configuration, tmp_path):
+    folder_index = import_addon_module_without_anki("folder_index")
+    folder = make_wallpaper_folder(tmp_path / "wallpapers", "a.png")
+    folder_mtime = folder.stat().st_mtime_ns
+
+    described_files = DescribedFiles()
+    folder_index.get_indexed_files(folder, described_files)
+    assert folder_index.read_index().mtime is None
+
+    # a file added in the same tick doesn't change the mtime of the folder
+    make_wallpaper_folder(folder, "b.png")
+    os.utime(folder, ns=(folder_mtime, folder_mtime))
+
+    described_files.names.clear()
+    files = folder_index.get_indexed_files(folder, described_files)
+    assert described_files.names == ["b.png"]
+    assert [file.name for file in files] == ["a.png", "b.png"]
+
+
+########################################################################################
+
+
+def test_rescan_doesnt_drop_pending_load_of_other_folder(configuration, anki, tmp_path):
+    config = configuration.Config(anki.get_environment())
+    config.load()
+    anki.deferred_tasks = []
+
+    other_folder = make_wallpaper_folder(tmp_path / "other", "c.png", "c.dark.png")
+    anki.data["folder_with_wallpapers"] = str(other_folder)
+    changes = []
+    config.load_changes(on_done=changes.append)
+
+    rescans = []
+    config.reload_wallpapers(on_done=lambda: rescans.append(config.folder_with_wallpapers))
+    [_load_task] = anki.deferred_tasks
+
+    anki.finish_task(0)
+    assert changes == [None]
+    assert config.folder_with_wallpapers == str(other_folder)
+    assert config.current_wallpaper.url.endswith("/c.png")
+
+    anki.finish_task(0)
+    assert rescans == [str(other_folder)]
+    assert anki.deferred_tasks == []
+
+
+def test_rescan_finishing_during_pending_load_is_done_again(configuration, anki,
+                                                           tmp_path):
+    config = configuration.Config(anki.get_environment())
+    config.load()
+    anki.deferred_tasks = []
+
+    config.reload_wallpapers()
+    config.load()
+    anki.finish_task(0)  # the rescan
+
+    anki.finish_task(0)  # the load
+    make_wallpaper_folder(tmp_path / "wallpapers", "c.png")
+    anki.finish_task(0)  # the rescan, again
+    assert len(config.wallpapers.light) == 3
+    assert anki.deferred_tasks == []
+
+
+def test_config_changes_dont_cancel_rescan(configuration, anki, tmp_path):
+    config = configuration.Config(anki.get_environment())
+    config.load()
+    anki.deferred_tasks = []
+
+    config.reload_wallpapers()
+    anki.data["enabled_for"] = ["main_window"]
+    config.load_changes(on_done=lambda _changes: None)
+
+    make_wallpaper_folder(tmp_path / "wallpapers", "c.png")
+    anki.finish_task(0)
+    assert len(config.wallpapers.light) == 3
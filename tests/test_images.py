@@ -0,0 +1,160 @@
+from dataclasses import replace
+from pathlib import Path
+
+import pytest
+from aqt.qt import QImage, QSize
+
+from tests.tools.headless import import_addon_module_without_anki
+
+
+# These tests need Qt, but not Anki.
+# Images are used instead of pixmaps, as they don't need a running application;
+# the cache only looks at their sizes.
+
+
+@pytest.fixture
+def images():
+    return import_addon_module_without_anki("images")
+
+
+def make_image(width, height) -> QImage:
+    image = QImage(width, height, QImage.Format.Format_ARGB32)
+    image.fill(0xff336699)
+    return image
+
+
+def test_pixmap_cache_evicts_least_recently_used_pixmaps(images):
+    cache = images.PixmapCache(size_limit_in_bytes=3 * 100 * 100 * 4)
+
+    for key in ["a", "b", "c"]:
+        cache.put(key, make_image(100, 100))
+    cache.get("a")
+    cache.put("d", make_image(100, 100))
+
+    assert [*cache.pixmaps] == ["c", "a", "d"]
+    assert cache.size_in_bytes == 3 * 100 * 100 * 4
+
+
+def test_pixmap_cache_accounts_for_replaced_pixmaps(images):
+    cache = images.PixmapCache(size_limit_in_bytes=1024 * 1024)
+
+    cache.put("a", make_image(100, 100))
+    cache.put("b", make_image(100, 100))
+    cache.put("a", make_image(50, 50))
+
+    assert [*cache.pixmaps] == ["b", "a"]
+    assert cache.size_in_bytes == (100 * 100 + 50 * 50) * 4
+
+
+def test_pixmap_cache_evicts_when_size_limit_is_lowered(images):
+    cache = images.PixmapCache(size_limit_in_bytes=1024 * 1024)
+
+    for key in ["a", "b", "c"]:
+        cache.put(key, make_image(100, 100))
+
+    cache.set_size_limit(2 * 100 * 100 * 4)
+    assert [*cache.pixmaps] == ["b", "c"]
+
+    # the most recently used pixmap is kept even if it doesn't fit
+    cache.set_size_limit(0)
+    assert [*cache.pixmaps] == ["c"]
+    assert cache.size_in_bytes == 100 * 100 * 4
+
+
+########################################################################################
+
+
+@pytest.fixture
+def image_path(tmp_path):
+    path = tmp_path / "wallpaper.png"
+    make_image(400, 300).save(str(path))
+    return str(path)
+
+
+def get_size(image: QImage):
+    return image.width(), image.height()
+
+
+def test_read_image_without_scale_reads_whole_image(images, image_path):
+    assert get_size(images.read_image(image_path)) == (400, 300)
+
+
+@pytest.mark.parametrize("scale, expected_size", [
+    (("contain", 200, 200, 1), (200, 150)),
+    (("cover", 200, 100, 1), (200, 150)),
+])
+def test_read_image_decodes_large_images_at_smaller_size(images, image_path,
+                                                         scale, expected_size):
+    assert get_size(images.read_image(image_path, scale)) == expected_size
+
+
+@pytest.mark.parametrize("scale", [
+    ("contain", 800, 800, 1),
+    ("cover", 400, 600, 2),
+])
+def test_read_image_never_upscales(images, image_path, scale):
+    assert get_size(images.read_image(image_path, scale)) == (400, 300)
+
+
+def test_read_image_returns_null_image_for_broken_files(images, tmp_path):
+    path = tmp_path / "broken.png"
+    path.write_bytes(b"not an image")
+    assert images.read_image(str(path), ("cover", 100, 100, 1)).isNull()
+
+
+########################################################################################
+
+
+@pytest.fixture
+def variants(tmp_path, monkeypatch):
+    variants = import_addon_module_without_anki("variants")
+    monkeypatch.setattr(variants, "VARIANTS_FOLDER", tmp_path / "variants")
+    return variants
+
+
+@pytest.fixture
+def configuration():
+    return import_addon_module_without_anki("configuration")
+
+
+def make_wallpaper(configuration, path: Path, width, height, size_is_known=True):
+    make_image(width, height).save(str(path))
+    wallpaper = configuration.Wallpaper.from_file_path(path)
+    return replace(wallpaper, width=width, height=height) if size_is_known else wallpaper
+
+
+@pytest.mark.parametrize("size_is_known", [True, False])
+def test_large_wallpapers_are_replaced_with_variants(configuration, variants, tmp_path,
+                                                     size_is_known):
+    large = make_wallpaper(configuration, tmp_path / "large.png", 800, 400, size_is_known)
+    small = make_wallpaper(configuration, tmp_path / "small.png", 100, 75, size_is_known)
+    max_size = QSize(200, 200)
+
+    unused_variant_path = variants.VARIANTS_FOLDER / "unused.png"
+    unused_variant_path.parent.mkdir()
+    unused_variant_path.write_bytes(b"")
+
+    assert variants.get_wallpapers_with_downscaled_variants(
+        [large, small], max_size, make_missing=False) == [large, small]
+    assert unused_variant_path.exists()
+
+    downscaled_large, downscaled_small = \
+        variants.get_wallpapers_with_downscaled_variants([large, small], max_size)
+
+    assert downscaled_small == small
+    assert downscaled_large.source_url == large.url
+    assert Path(downscaled_large.url).parent == variants.VARIANTS_FOLDER
+    assert get_size(QImage(downscaled_large.url)) == (400, 200)
+    assert not unused_variant_path.exists()
+
+    assert variants.get_wallpapers_with_downscaled_variants(
+        [large, small], max_size, make_missing=False) == [downscaled_large, small]
+
+
+def test_files_of_wallpapers_known_to_be_small_are_not_opened(configuration, variants,
+                                                              tmp_path):
+    wallpaper = replace(configuration.Wallpaper.from_file_path(tmp_path / "missing.png"),
+                        width=100, height=75)
+
+    assert variants.get_wallpapers_with_downscaled_variants(
+        [wallpaper], QSize(200, 200)) == [wallpaper]
@@ -0,0 +1,36 @@
+from tests.tools.headless import import_addon_module_without_anki
+
+
+def test_profiler_only_measures_when_enabled(monkeypatch):
+    profiling = import_addon_module_without_anki("profiling")
+    profiler = profiling.Profiler()
+    monkeypatch.setattr(profiling, "profiler", profiler)
+
+    @profiling.timed()
+    def function(argument):
+        return argument
+
+    assert function(1) == 1
+    assert profiler.timings == {}
+
+    profiler.enabled = True
+    function(1)
+    function(2)
+
+    [(name, timing)] = profiler.timings.items()
+    assert name.endswith("function")
+    assert timing.calls == 2
+    assert timing.max_seconds <= timing.total_seconds
+
+
+def test_profiler_dumps_report(tmp_path):
+    profiling = import_addon_module_without_anki("profiling")
+    profiler = profiling.Profiler()
+    profiler.enabled = True
+
+    with profiler.measuring("hook"):
+        pass
+
+    profiler.dump(tmp_path / "timings.txt")
+    report = (tmp_path / "timings.txt").read_text()
+    assert "hook" in report
@@ -1,7 +1,9 @@
 import os
 import re
+import shutil
 import sys
 from contextlib import contextmanager
+from pathlib import Path
 from unittest.mock import MagicMock
 
 import aqt
@@ -21,10 +23,38 @@ def get_screenshot(window: QWidget) -> QImage:
     return window.grab().toImage()
 
 
+# Grabbing a window is slow, so take a single screenshot and read all pixels from it.
+# Pixels are read straight from the image buffer, as in `pixels[y, x]`.
+# This is only possible for 32-bit formats, which is what `grab()` produces anyway.
+class Screenshot:
+    thirty_two_bit_formats = {
+        QImage.Format.Format_RGB32,
+        QImage.Format.Format_ARGB32,
+        QImage.Format.Format_ARGB32_Premultiplied,
+    }
+
+    def __init__(self, obj: "QWidget | QImage"):
+        image = get_screenshot(obj) if isinstance(obj, QWidget) else obj
+
+        if image.format() not in self.thirty_two_bit_formats:
+            image = image.convertToFormat(QImage.Format.Format_ARGB32)
+
+        bits = image.constBits()
+        bits.setsize(image.sizeInBytes())
+
+        self.image = image  # the view doesn't keep the image alive
+        self.pixels = memoryview(bits).cast("I", (image.height(), image.width()))
+
+    def get_colors(self, *coordinates: "tuple[int, int]") -> "list[str]":
+        return [QColor(self.pixels[y, x]).name() for x, y in coordinates]
+
+
+def get_colors(obj: "QWidget | QImage", *coordinates: "tuple[int, int]") -> "list[str]":
+    return Screenshot(obj).get_colors(*coordinates)
+
+
 def get_color(obj: "QWidget | QImage", x: int, y: int) -> str:
-    if isinstance(obj, QWidget):
-        obj = get_screenshot(obj)
-    return QColor(obj.pixel(x, y)).name()
+    return get_colors(obj, (x, y))[0]
 
 
 def save_screenshot(window: QWidget, image_title: str):
@@ -61,12 +91,11 @@ def get_main_window():
     # looking for the gray line below upper links.
     # it might have different colors, so just see if there's anything at all
     def main_window_ready():
-        screenshot = get_screenshot(window)
-        different_colors = {get_color(screenshot, 5, 40 + x) for x in range(16)}
+        different_colors = {*get_colors(window, *((5, 40 + x) for x in range(16)))}
         return len(different_colors) > 1
 
     with screenshot_saved_on_error(window):
-        wait_until(main_window_ready)
+        wait_until(main_window_ready, wake_on=[window])
 
     return window
 
@@ -76,7 +105,8 @@ def open_add_cards_dialog():
     dialog.resize(500, 500)
 
     with screenshot_saved_on_error(dialog):
-        wait_until(lambda: get_color(dialog, 330, 230) == "#ffffff")  # field2
+        wait_until(lambda: get_color(dialog, 330, 230) == "#ffffff",  # field2
+                   wake_on=[dialog, dialog.editor.web.loadFinished])
 
     return dialog
 
@@ -87,7 +117,8 @@ def open_edit_current_dialog():
     dialog.resize(500, 500)
 
     with screenshot_saved_on_error(dialog):
-        wait_until(lambda: get_color(dialog, 330, 200) == "#ffffff")  # field2
+        wait_until(lambda: get_color(dialog, 330, 200) == "#ffffff",  # field2
+                   wake_on=[dialog, dialog.editor.web.loadFinished])
 
     return dialog
 
@@ -102,7 +133,8 @@ def previewer_open():
     previewer.resize(500, 500)
 
     with screenshot_saved_on_error(previewer):
-        wait_until(lambda: get_color(previewer, 30, 30) == "#ff0000")  # our red marker
+        wait_until(lambda: get_color(previewer, 30, 30) == "#ff0000",  # our red marker
+                   wake_on=[previewer, previewer._web.loadFinished])
 
     try:
         yield previewer
@@ -126,10 +158,12 @@ def test_main_window(setup):
     window = get_main_window()
 
     with screenshot_saved_on_error(window):
-        assert get_color(window, 5, 5) in light_colors  # menu
-        assert get_color(window, 5, 40) in light_colors  # links
-        assert get_color(window, 5, 280) in light_colors  # main area
-        assert get_color(window, 5, 490) in light_colors  # bottom area
+        menu, links, main_area, bottom_area = \
+            get_colors(window, (5, 5), (5, 40), (5, 280), (5, 490))
+        assert menu in light_colors
+        assert links in light_colors
+        assert main_area in light_colors
+        assert bottom_area in light_colors
 
 
 # on Anki 2.1.49 tag area is an input field and has white background
@@ -138,31 +172,36 @@ def test_add_cards_dialog(setup):
     dialog = open_add_cards_dialog()
 
     with screenshot_saved_on_error(dialog):
-        assert get_color(dialog, 5, 5) in light_colors  # edge
-        assert get_color(dialog, 270, 80) in light_colors  # buttons area
-        assert get_color(dialog, 270, 270) in light_colors  # main area
+        edge, buttons_area, main_area, tags_area, bottom_area = \
+            get_colors(dialog, (5, 5), (270, 80), (270, 270), (270, 430), (5, 490))
+        assert edge in light_colors
+        assert buttons_area in light_colors
+        assert main_area in light_colors
         if anki_version >= (2, 1, 50):
-            assert get_color(dialog, 270, 430) in light_colors  # tags area
-        assert get_color(dialog, 5, 490) in light_colors  # bottom area
+            assert tags_area in light_colors
+        assert bottom_area in light_colors
 
 
 def test_edit_current_dialog(setup):
     dialog = open_edit_current_dialog()
 
     with screenshot_saved_on_error(dialog):
-        assert get_color(dialog, 5, 5) in light_colors  # edge
-        assert get_color(dialog, 270, 60) in light_colors  # buttons area
-        assert get_color(dialog, 270, 270) in light_colors  # main area
+        edge, buttons_area, main_area, tags_area, bottom_area = \
+            get_colors(dialog, (5, 5), (270, 60), (270, 270), (270, 440), (5, 490))
+        assert edge in light_colors
+        assert buttons_area in light_colors
+        assert main_area in light_colors
         if anki_version >= (2, 1, 50):
-            assert get_color(dialog, 270, 440) in light_colors  # tags area
-        assert get_color(dialog, 5, 490) in light_colors  # bottom area
+            assert tags_area in light_colors
+        assert bottom_area in light_colors
 
 
 def test_previewer(setup):
     with previewer_open() as previewer:
         with screenshot_saved_on_error(previewer):
-            assert get_color(previewer, 5, 5) in light_colors  # edge
-            assert get_color(previewer, 5, 490) in light_colors  # bottom area
+            edge, bottom_area = get_colors(previewer, (5, 5), (5, 490))
+            assert edge in light_colors
+            assert bottom_area in light_colors
 
 
 ########################################################################### test changes
@@ -197,6 +236,72 @@ def test_next_wallpaper(setup):
         wait_until(lambda: {*get_colors()} <= {*current_colors})
 
 
+def test_next_wallpaper_changes_previewer_wallpaper(setup):
+    with previewer_open() as previewer:
+        def get_previewer_color():
+            return get_color(previewer, 5, 5)
+
+        assert get_previewer_color() in light_colors
+        alternate_colors = kitten if get_previewer_color() in puppy else puppy
+
+        setup.anki_wallpaper.next_wallpaper()
+        wait_until(lambda: get_previewer_color() in alternate_colors, wake_on=[previewer])
+
+
+def test_slideshow_switches_wallpapers(setup):
+    with all_windows_set_up() as get_colors:
+        alternate_colors = kitten if {*get_colors()} <= {*puppy} else puppy
+
+        aqt.mw.activateWindow()
+        setup.anki_wallpaper.slideshow.set_interval(0.005)  # 300 ms
+        try:
+            wait_until(lambda: {*get_colors()} <= {*alternate_colors})
+        finally:
+            setup.anki_wallpaper.slideshow.set_interval(0)
+
+
+# 16:9 wallpapers in a 600×500 window: with `contain`, there are bars above
+# and below the wallpaper, but not on its sides; with `cover`, there are none
+@pytest.mark.parametrize("scaling, wallpaper_coordinates, other_coordinates", [
+    ("contain", [(5, 250), (595, 250)], [(5, 5), (300, 495)]),
+    ("cover", [(5, 5), (5, 250), (595, 250), (300, 495)], []),
+])
+def test_scaling(setup, tmpdir, scaling, wallpaper_coordinates, other_coordinates):
+    red = "#ff0000"
+    for file_name in ["wide.png", "wide.dark.png"]:
+        image = QImage(1600, 900, QImage.Format.Format_RGB32)
+        image.fill(QColor(red))
+        image.save(str(tmpdir / file_name))
+
+    with editing_config() as editor:
+        editor.text = re.sub(r'"/[^"]+"', f'"{tmpdir.strpath}"', editor.text)
+        editor.text = re.sub(r'"scaling": "\w+"', f'"scaling": "{scaling}"', editor.text)
+
+    window = get_main_window()
+    set_window_dimensions(window, 600, 500)
+
+    def wallpaper_is_scaled():
+        colors = get_colors(window, *wallpaper_coordinates, *other_coordinates)
+        return colors[:len(wallpaper_coordinates)] == [red] * len(wallpaper_coordinates) \
+            and red not in colors[len(wallpaper_coordinates):]
+
+    with screenshot_saved_on_error(window):
+        wait_until(wallpaper_is_scaled, wake_on=[window])
+
+
+def test_wallpaper_index_is_saved_lazily(setup):
+    def get_saved_light_wallpaper_index():
+        return aqt.mw.addonManager.getConfig("anki_wallpaper")["light_wallpaper_index"]
+
+    saved_light_wallpaper_index = get_saved_light_wallpaper_index()
+
+    setup.anki_wallpaper.next_wallpaper()
+    assert get_saved_light_wallpaper_index() == saved_light_wallpaper_index
+
+    setup.anki_wallpaper.config.save_indexes()
+    assert get_saved_light_wallpaper_index() == setup.anki_wallpaper.config.indexes.light
+
+
 @pytest.mark.skipif(anki_version < (2, 1, 50), reason="not applicable to Anki < 2.1.50")
 def test_theme_change(setup):
     from aqt.theme import Theme
@@ -273,21 +378,70 @@ def test_config_editor_freaks_out_if_json_does_not_match_schema(setup):
 
 
 def test_anki_wallpaper_freaks_out_if_wallpaper_folder_does_not_exist(setup):
-    with show_info_mocked(setup.anki_wallpaper.configuration, "showWarning") as called:
+    with show_info_mocked(setup.anki_wallpaper.anki_environment, "showWarning") as called:
         with editing_config() as editor:
             editor.text = re.sub(r'"/[^"]+"', '"/owo whats this/"', editor.text)
         assert "No such file" in called.text
 
 
 def test_anki_wallpaper_freaks_out_if_wallpaper_folder_is_not_accessible(setup):
-    with show_info_mocked(setup.anki_wallpaper.configuration, "showWarning") as called:
+    with show_info_mocked(setup.anki_wallpaper.anki_environment, "showWarning") as called:
         with editing_config() as editor:
             editor.text = re.sub(r'"/[^"]+"', '"/root/"', editor.text)
         assert "Permission denied" in called.text
 
 
 def test_anki_wallpaper_freaks_out_if_wallpapers_files_are_missing(setup, tmpdir):
-    with show_info_mocked(setup.anki_wallpaper.configuration, "showWarning") as called:
+    with show_info_mocked(setup.anki_wallpaper.anki_environment, "showWarning") as called:
         with editing_config() as editor:
             editor.text = re.sub(r'"/[^"]+"', f'"{tmpdir.strpath}"', editor.text)
         assert "does not contain dark wallpapers" in called.text
+
+
+def use_copy_of_sample_wallpapers(setup, tmpdir):
+    sample_wallpapers_folder = Path(setup.anki_wallpaper.__file__).parent / "sample_wallpapers"
+    for file in sample_wallpapers_folder.iterdir():
+        shutil.copy(file, tmpdir.strpath)
+
+    with editing_config() as editor:
+        editor.text = re.sub(r'"/[^"]+"', f'"{tmpdir.strpath}"', editor.text)
+
+
+# Files that don't look like images at all, such as `Thumbs.db`, are skipped silently
+def test_anki_wallpaper_freaks_out_if_wallpaper_is_not_a_valid_image(setup, tmpdir):
+    (tmpdir / "broken.png").write_binary(b"owo whats this")
+    (tmpdir / "Thumbs.db").write_binary(b"\0" * 64)
+
+    with show_info_mocked(setup.anki_wallpaper.anki_environment, "showWarning") as called:
+        use_copy_of_sample_wallpapers(setup, tmpdir)
+        assert "File is not a valid image" in called.text
+        assert "broken.png" in called.text
+        assert "Thumbs.db" not in called.text
+
+    light_wallpapers = setup.anki_wallpaper.config.wallpapers.light
+    assert [Path(wallpaper.url).name for wallpaper in light_wallpapers] \
+           == ["kitten.png", "puppy.png"]
+
+
+def test_wallpapers_added_to_folder_are_picked_up_on_load(setup, tmpdir):
+    use_copy_of_sample_wallpapers(setup, tmpdir)
+
+    config = setup.anki_wallpaper.config
+    assert len(config.wallpapers.light) == 2
+    assert len(config.wallpapers.dark) == 2
+
+    shutil.copy(tmpdir / "puppy.dark.png", tmpdir / "doggo.dark.png")
+    config.load()
+    assert len(config.wallpapers.light) == 2
+    assert len(config.wallpapers.dark) == 3
+
+
+def test_wallpapers_added_to_folder_are_picked_up_while_anki_is_running(setup, tmpdir):
+    use_copy_of_sample_wallpapers(setup, tmpdir)
+
+    config = setup.anki_wallpaper.config
+    current_wallpaper = config.current_wallpaper
+
+    shutil.copy(tmpdir / "puppy.png", tmpdir / "aardvark.png")
+    wait_until(lambda: len(config.wallpapers.light) == 3)
+    assert config.current_wallpaper == current_wallpaper
@@ -0,0 +1,248 @@
+import json
+import os
+import statistics
+import time
+from dataclasses import dataclass, asdict
+from pathlib import Path
+
+import pytest
+from aqt.qt import Qt, QImage, QLinearGradient, QPainter, QColor
+
+
+# Benchmarks are marked with `@pytest.mark.benchmark`, and are skipped unless
+# `--benchmark` is passed. As the numbers only make sense for the machine
+# they were obtained on, the baseline is not a part of the repository.
+# Benchmarks are best run in a single process, with `-n 0`.
+#
+#   pytest -n 0 --benchmark --save-benchmark-baseline  # record the baseline
+#   pytest -n 0 --benchmark                            # compare to it
+#
+# A benchmark fails if its median time exceeds that of the baseline
+# multiplied by `--benchmark-threshold`.
+#
+# Results are passed to the main process along with the test reports,
+# so that with several workers they are still all reported at the end of the run,
+# and the baseline is only written by the main process.
+
+DEFAULT_BASELINE_PATH = ".benchmarks/baseline.json"
+DEFAULT_THRESHOLD = 1.5
+
+
+def add_benchmark_options(parser):
+    parser.addoption("--benchmark",
+                     action="store_true",
+                     default=False,
+                     help="run benchmarks")
+    parser.addoption("--benchmark-baseline",
+                     default=DEFAULT_BASELINE_PATH,
+                     help=f"benchmark baseline file (default: {DEFAULT_BASELINE_PATH})")
+    parser.addoption("--save-benchmark-baseline",
+                     action="store_true",
+                     default=False,
+                     help="save benchmark results as the new baseline")
+    parser.addoption("--benchmark-threshold",
+                     type=float,
+                     default=DEFAULT_THRESHOLD,
+                     help=f"fail benchmarks that are this many times slower "
+                          f"than the baseline (default: {DEFAULT_THRESHOLD})")
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "benchmark: a benchmark; run with --benchmark")
+
+
+def get_baseline_path(config) -> Path:
+    return Path(config.rootpath) / config.option.benchmark_baseline
+
+
+def is_worker(config) -> bool:
+    return hasattr(config, "workerinput")
+
+
+def pytest_collection_modifyitems(config, items):
+    if not config.option.benchmark:
+        skip = pytest.mark.skip(reason="benchmarks are only run with --benchmark")
+        for item in items:
+            if "benchmark" in item.keywords:
+                item.add_marker(skip)
+
+
+########################################################################################
+
+
+@dataclass
+class Result:
+    rounds: int
+    p50: float
+    p90: float
+    p99: float
+    max: float
+
+    @classmethod
+    def from_durations(cls, durations: "list[float]"):
+        percentiles = statistics.quantiles(durations, n=100, method="inclusive")
+        return cls(len(durations), percentiles[49], percentiles[89], percentiles[98],
+                   max(durations))
+
+    def __str__(self):
+        def ms(seconds):
+            return f"{seconds * 1000:9.2f} ms"
+        return f"p50 {ms(self.p50)}   p90 {ms(self.p90)}   " \
+               f"p99 {ms(self.p99)}   max {ms(self.max)}   ({self.rounds} rounds)"
+
+
+def read_baseline(path: Path) -> "dict[str, Result]":
+    try:
+        with path.open(encoding="utf-8") as file:
+            return {name: Result(**result) for name, result in json.load(file).items()}
+    except FileNotFoundError:
+        return {}
+
+
+# Results of other benchmarks in the file are preserved,
+# so that the baseline can be updated for a subset of benchmarks
+def write_baseline(path: Path, results: "dict[str, Result]"):
+    baseline = {**read_baseline(path), **results}
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open("w", encoding="utf-8") as file:
+        json.dump({name: asdict(result) for name, result in sorted(baseline.items())},
+                  file, indent=4)
+
+
+# Results of the benchmarks, as collected from the test reports
+benchmark_results: "dict[str, Result]" = {}
+
+
+def pytest_runtest_logreport(report):
+    if report.when == "call":
+        for key, value in report.user_properties:
+            if key == "benchmark":
+                name, result = value
+                benchmark_results[name] = Result(**result)
+
+
+def pytest_sessionfinish(session):
+    config = session.config
+    if config.option.save_benchmark_baseline and benchmark_results and not is_worker(config):
+        write_baseline(get_baseline_path(config), benchmark_results)
+
+
+def pytest_terminal_summary(terminalreporter, config):
+    if not benchmark_results or is_worker(config):
+        return
+
+    baseline = {} if config.option.save_benchmark_baseline \
+        else read_baseline(get_baseline_path(config))
+    width = max(len("(baseline)"), *(len(name) for name in benchmark_results))
+
+    terminalreporter.section("benchmarks")
+    for name, result in sorted(benchmark_results.items()):
+        terminalreporter.write_line(f"{name:{width}}   {result}")
+        if name in baseline:
+            terminalreporter.write_line(f"{'(baseline)':>{width}}   {baseline[name]}")
+
+
+class Benchmarks:
+    def __init__(self, node, baseline: "dict[str, Result]", threshold: float):
+        self.node = node
+        self.baseline = baseline
+        self.threshold = threshold
+
+    # Calls `function` `rounds` times, after a single warm-up call,
+    # measuring each call. If given, `before_each` is called before every call,
+    # outside of measurement.
+    def measure(self, name: str, function, rounds: int = 20, before_each=None) -> Result:
+        durations = []
+
+        for round_ in range(rounds + 1):
+            if before_each:
+                before_each()
+            start = time.perf_counter()
+            function()
+            duration = time.perf_counter() - start
+            if round_ > 0:
+                durations.append(duration)
+
+        result = Result.from_durations(durations)
+        self.node.user_properties.append(("benchmark", (name, asdict(result))))
+
+        if baseline := self.baseline.get(name):
+            if result.p50 > baseline.p50 * self.threshold:
+                pytest.fail(f"Benchmark {name} regressed: median time is "
+                            f"{result.p50 * 1000:.2f} ms, baseline is "
+                            f"{baseline.p50 * 1000:.2f} ms", pytrace=False)
+
+        return result
+
+
+@pytest.fixture(scope="session")
+def benchmark_baseline(request) -> "dict[str, Result]":
+    config = request.config
+    return {} if config.option.save_benchmark_baseline \
+        else read_baseline(get_baseline_path(config))
+
+
+@pytest.fixture
+def benchmarks(request, benchmark_baseline):
+    return Benchmarks(request.node, benchmark_baseline,
+                      threshold=request.config.option.benchmark_threshold)
+
+
+########################################################################################
+
+
+def make_gradient_image(width: int, height: int, dark: bool) -> QImage:
+    start, end = ("#101828", "#3a1c4a") if dark else ("#fdf6e3", "#a7c7e7")
+
+    gradient = QLinearGradient(0, 0, width, height)
+    gradient.setColorAt(0, QColor(start))
+    gradient.setColorAt(1, QColor(end))
+
+    image = QImage(width, height, QImage.Format.Format_RGB32)
+    painter = QPainter(image)
+    painter.fillRect(image.rect(), gradient)
+    painter.setPen(QColor(Qt.GlobalColor.white))
+    painter.drawEllipse(width // 4, height // 4, width // 2, height // 2)
+    painter.end()
+    return image
+
+
+# Makes a folder with `count` wallpapers, half of them dark.
+# The files are hard links to a single light and a single dark image,
+# so that even large folders don't take a lot of space;
+# to the add-on, they are still separate wallpapers.
+# The folder is backdated, so that its mtime can be trusted by the folder index.
+def make_synthetic_wallpaper_folder(folder: Path, count: int, width: int, height: int):
+    folder.mkdir(parents=True, exist_ok=True)
+    sources = {}
+
+    for dark in [False, True]:
+        sources[dark] = folder.parent / f"source-{width}x{height}{'.dark' if dark else ''}.png"
+        if not sources[dark].exists():
+            make_gradient_image(width, height, dark).save(str(sources[dark]))
+
+    for number in range(count):
+        dark = number % 2 == 1
+        path = folder / f"wallpaper-{number:05}{'.dark' if dark else ''}.png"
+        try:
+            os.link(sources[dark], path)
+        except OSError:
+            path.write_bytes(sources[dark].read_bytes())
+
+    an_hour_ago = time.time() - 60 * 60
+    os.utime(folder, (an_hour_ago, an_hour_ago))
+
+
+@pytest.fixture(scope="session")
+def synthetic_wallpaper_folders(tmp_path_factory):
+    base = tmp_path_factory.mktemp("synthetic_wallpapers")
+    folders = {}
+
+    def get_folder(count: int, width: int, height: int) -> Path:
+        key = count, width, height
+        if key not in folders:
+            folders[key] = base / f"{count}-{width}x{height}"
+            make_synthetic_wallpaper_folder(folders[key], count, width, height)
+        return folders[key]
+
+    return get_folder
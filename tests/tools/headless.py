@@ -0,0 +1,21 @@
+import importlib
+import sys
+import types
+from pathlib import Path
+
+
+addon_folder = Path(__file__).parent.parent.parent / "anki_wallpaper"
+headless_package_name = "anki_wallpaper_headless"
+
+
+# Imports a module of the add-on without running the `__init__.py` of the add-on,
+# which needs a running Anki. The module is imported as a submodule of a synthetic
+# package, so that relative imports work. The package has a different name
+# from the add-on, so that it doesn't get in the way of importing the add-on itself.
+def import_addon_module_without_anki(module_name: str):
+    if headless_package_name not in sys.modules:
+        package = types.ModuleType(headless_package_name)
+        package.__path__ = [str(addon_folder)]
+        sys.modules[headless_package_name] = package
+
+    return importlib.import_module(f"{headless_package_name}.{module_name}")
@@ -1,15 +1,18 @@
 import concurrent.futures
 import time
 from contextlib import contextmanager
+from functools import partial
 from pathlib import Path
 
 import anki.collection
 import aqt.operations.note
 import pytest
 from _pytest.monkeypatch import MonkeyPatch  # noqa
+from aqt.qt import QEvent, QEventLoop, QObject, QTimer, QWidget
 from pytest_anki._launch import anki_running, temporary_user  # noqa
 from waitress import wasyncore
 
+from tests.tools.benchmarking import add_benchmark_options
 from tests.tools.collection import (
     anki_version,
     get_decks,
@@ -31,13 +34,81 @@ def wait(seconds):
     QtTest.QTest.qWait(milliseconds)  # noqa
 
 
-def wait_until(booleanish_function, at_most_seconds=10):
+class PaintEventFilter(QObject):
+    def __init__(self, callback):
+        super().__init__()
+        self.callback = callback
+
+    def eventFilter(self, obj, event):  # noqa
+        if event.type() == QEvent.Type.Paint:
+            self.callback()
+        return False
+
+
+# Sources can be Qt signals, Anki hooks, or widgets, in which case
+# the callback is called when they are painted.
+@contextmanager
+def calling_back_on(sources, callback):
+    def callback_ignoring_arguments(*_args, **_kwargs):
+        callback()
+
+    disconnectors = []
+
+    try:
+        for source in sources:
+            if isinstance(source, QWidget):
+                event_filter = PaintEventFilter(callback)
+                source.installEventFilter(event_filter)
+                disconnectors.append(partial(source.removeEventFilter, event_filter))
+            elif hasattr(source, "connect"):
+                source.connect(callback_ignoring_arguments)
+                disconnectors.append(partial(source.disconnect, callback_ignoring_arguments))
+            else:
+                source.append(callback_ignoring_arguments)
+                disconnectors.append(partial(source.remove, callback_ignoring_arguments))
+        yield
+    finally:
+        for disconnect in disconnectors:
+            try:
+                disconnect()
+            except (RuntimeError, TypeError):  # the source has been deleted already
+                pass
+
+
+# Process events until either one of the sources fires, or the timeout expires
+def wait_for_any(sources, at_most_seconds):
+    loop = QEventLoop()
+    timer = QTimer()
+    timer.setSingleShot(True)
+    timer.timeout.connect(loop.quit)  # noqa
+
+    with calling_back_on(sources, loop.quit):
+        timer.start(max(1, int(at_most_seconds * 1000)))
+        loop.exec()
+        timer.stop()
+
+
+MIN_POLLING_INTERVAL_SECONDS = 0.001
+MAX_POLLING_INTERVAL_SECONDS = 0.1
+
+
+# The function is checked whenever any of `wake_on` fires (see `calling_back_on`).
+# As not everything can be waited upon, it is also checked periodically,
+# with the polling interval doubling each time, up to a limit.
+def wait_until(booleanish_function, at_most_seconds=10, wake_on=()):
     deadline = time.time() + at_most_seconds
+    polling_interval = MIN_POLLING_INTERVAL_SECONDS
 
-    while time.time() < deadline:
+    while True:
         if booleanish_function():
             return
-        wait(0.01)
+
+        remaining_seconds = deadline - time.time()
+        if remaining_seconds <= 0:
+            break
+
+        wait_for_any(wake_on, min(polling_interval, remaining_seconds))
+        polling_interval = min(polling_interval * 2, MAX_POLLING_INTERVAL_SECONDS)
 
     raise Exception(f"Function {booleanish_function} never once returned "
                     f"a positive value in {at_most_seconds} seconds")
@@ -109,17 +180,31 @@ def anki_patched_to_prevent_backups():
         yield
 
 
+# When tests are run in parallel with pytest-xdist, each worker is a separate process
+# that starts its own Anki. Qt WebEngine keeps its caches in the home folder,
+# so each worker gets its own, along with its own Anki base folder.
+# pytest-xvfb, if installed, gives each worker its own virtual display.
+@contextmanager
+def home_folder_set_to(path: Path):
+    path.mkdir(parents=True, exist_ok=True)
+    with MonkeyPatch().context() as monkey:
+        monkey.setenv("HOME", str(path))
+        yield
+
+
 @contextmanager
-def empty_anki_session_started():
-    with waitress_patched_to_prevent_it_from_dying():
-        with anki_patched_to_prevent_backups():
-            with anki_running(
-                qtbot=None,  # noqa
-                enable_web_debugging=False,
-                profile_name="test_user",
-                unpacked_addons=addons_to_copy_into_anki_addons_folders
-            ) as session:
-                yield session
+def empty_anki_session_started(base_path: Path):
+    with home_folder_set_to(base_path / "home"):
+        with waitress_patched_to_prevent_it_from_dying():
+            with anki_patched_to_prevent_backups():
+                with anki_running(
+                    qtbot=None,  # noqa
+                    base_path=str(base_path),
+                    enable_web_debugging=False,
+                    profile_name="test_user",
+                    unpacked_addons=addons_to_copy_into_anki_addons_folders
+                ) as session:
+                    yield session
 
 
 @contextmanager
@@ -160,16 +245,23 @@ def pytest_addoption(parser):
     parser.addoption("--no-tear-down-profile-after-each-test", "-T",
                      action="store_false",
                      dest="tear_down_profile_after_each_test")
+    add_benchmark_options(parser)
 
 
 def pytest_report_header(config):  # noqa
     if config.option.forked:
-        return "test isolation: perfect; each test is run in a separate process"
-    if config.option.tear_down_profile_after_each_test:
-        return "test isolation: good; user profile is torn down after each test"
+        header = ["test isolation: perfect; each test is run in a separate process"]
+    elif config.option.tear_down_profile_after_each_test:
+        header = ["test isolation: good; user profile is torn down after each test"]
     else:
-        return "test isolation: poor; only newly created decks and models " \
-               "are cleaned up between tests"
+        header = ["test isolation: poor; only newly created decks and models "
+                  "are cleaned up between tests"]
+
+    if getattr(config.option, "numprocesses", None):
+        header.append("tests are distributed between worker processes; "
+                      "each has its own Anki, profile, home folder and display")
+
+    return header
 
 
 @pytest.fixture(autouse=True)
@@ -201,9 +293,10 @@ def pytest_generate_tests(metafunc):
         metafunc.fixturenames.remove(run_background_tasks_on_main_thread.__name__)
 
 
+# `tmp_path_factory` makes a separate folder for every pytest-xdist worker
 @pytest.fixture(scope="session")
-def session_scope_empty_session():
-    with empty_anki_session_started() as session:
+def session_scope_empty_session(tmp_path_factory):
+    with empty_anki_session_started(tmp_path_factory.mktemp("anki")) as session:
         yield session
 
 